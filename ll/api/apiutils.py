@@ -15,9 +15,15 @@
 
 import traceback
 import re
-from flask.ext.restful import Resource, abort, fields
+import json
+import hashlib
+from flask import Response, request, stream_with_context
+from werkzeug.http import http_date
+from flask.ext.restful import Resource, abort, fields, marshal
 from .. import core
 
+NDJSON_MIMETYPE = "application/x-ndjson"
+
 
 class ContentField(fields.Raw):
     def format(self, value):
@@ -78,6 +84,52 @@ class ApiResource(Resource):
         except Exception, e:
             self.abort(400, e, traceback.format_exc())
 
+    def wants_ndjson(self):
+        return request.accept_mimetypes.best_match(
+            ["application/json", NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+    def stream_ndjson(self, items, item_fields):
+        """
+        Returns a response that marshals items one at a time and writes them
+        as newline delimited JSON, so a cursor is never held in memory.
+        """
+        items = iter(items)
+        # A failing query only raises when the first item is read, which has
+        # to happen before the response starts to get a 4xx status
+        first = self.trycall(next, items, None)
+
+        def generate():
+            if first is None:
+                return
+            yield json.dumps(marshal(first, item_fields)) + "\n"
+            for item in items:
+                yield json.dumps(marshal(item, item_fields)) + "\n"
+        return Response(stream_with_context(generate()),
+                        mimetype=NDJSON_MIMETYPE)
+
+    def check_version(self, version):
+        """
+        Takes a (state, last_modified) version as returned by the core
+        get_*_version functions. Returns the ETag and Last-Modified headers
+        for it, and a 304 response if the client already has this version
+        (None otherwise).
+        """
+        state, last_modified = version
+        etag = hashlib.md5(repr(state)).hexdigest()
+        headers = {"ETag": 'W/"%s"' % etag, "Cache-Control": "no-cache"}
+        if last_modified is not None:
+            headers["Last-Modified"] = http_date(last_modified)
+        if request.if_none_match:
+            fresh = request.if_none_match.contains_weak(etag)
+        elif request.if_modified_since and last_modified is not None:
+            fresh = last_modified.replace(microsecond=0) <= \
+                request.if_modified_since.replace(tzinfo=None)
+        else:
+            fresh = False
+        if fresh:
+            return headers, Response(status=304, headers=headers)
+        return headers, None
+
     def get_site_id(self, key):
         user = self.trycall(core.user.get_user, key)
         if not user:
@@ -31,6 +31,9 @@ doclist_fields_relevance_signals = {
     "site_id": fields.String(),
 }
 
+# Only these fields are read from the database for doclists
+doclist_projection = ["title", "site_id"]
+
 doc_fields = {
     "docid": fields.String(attribute="_id"),
     "creation_time": fields.DateTime(),
@@ -86,7 +89,13 @@ class Docs(ApiResource):
             time).
 
 
+        To receive the documents one at a time, as they are read from the
+        database, send an ``Accept: application/x-ndjson`` header. The
+        response then holds one document per line instead of the "docs"
+        list.
+
         :param key: your API key
+        :reqheader Accept: *optional*, ``application/x-ndjson`` to stream
         :status 403: invalid key
         :return:
             .. sourcecode:: javascript
@@ -106,6 +115,8 @@ class Docs(ApiResource):
         """
         self.validate_participant(key)
         docs = self.trycall(core.doc.get_docs, key=key)
+        if self.wants_ndjson():
+            return self.stream_ndjson(docs, doc_fields)
         return {"docs": [marshal(doc, doc_fields) for doc in docs]}
 
 
@@ -118,9 +129,13 @@ class DocList(ApiResource):
 
         .. note:: This document list may change over time.
 
+        Responses carry an ETag and Last-Modified header. Send them back in
+        If-None-Match or If-Modified-Since to get an empty 304 response when
+        nothing changed.
 
         :param key: your API key
         :param qid: the query identifier
+        :status 304: doclist did not change
         :status 403: invalid key
         :status 404: query does not exist
         :status 400: bad request
@@ -157,13 +172,18 @@ class DocList(ApiResource):
                 }
         """
         self.validate_participant(key)
-        doclist = self.trycall(core.doc.get_doclist, qid=qid, key=key)
+        headers, not_modified = self.check_version(
+            self.trycall(core.doc.get_doclist_version, qid=qid, key=key))
+        if not_modified:
+            return not_modified
+        doclist = self.trycall(core.doc.get_doclist, qid=qid, key=key,
+                               projection=doclist_projection)
         return {
             "qid": qid,
             "doclist": [marshal(d, doclist_fields_relevance_signals)
                 if "relevance_signals" in d else marshal(d, doclist_fields)
                 for d in doclist]
-            }
+            }, 200, headers
 
 api.add_resource(Doc, '/api/participant/doc/<key>/<docid>',
                  endpoint="participant/doc")
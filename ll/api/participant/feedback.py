@@ -13,6 +13,7 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with Living Labs Challenge. If not, see <http://www.gnu.org/licenses/>.
 
+from flask import request
 from flask.ext.restful import Resource, fields, marshal
 from .. import api
 from .. import core
@@ -25,6 +26,7 @@ doc_fields = {
 }
 
 feedback_fields = {
+    "sid": fields.String(attribute="_id"),
     "qid": fields.String(),
     "modified_time": fields.DateTime(),
     "type": fields.String(),
@@ -56,9 +58,23 @@ class Feedback(ApiResource):
 
         Feedback is never given for test queries.
 
+        Every response carries a "cursor". Pass it as the ``since``
+        parameter of your next request to only receive feedback that was
+        added or updated in the meantime. Feedback for a session can be
+        updated as more clicks come in; use its "sid" to replace what you
+        received earlier.
+
+        To receive the feedback one at a time, as it is read from the
+        database, send an ``Accept: application/x-ndjson`` header. The
+        response then holds one feedback per line instead of the "feedback"
+        list, and the cursor is sent in the ``X-Feedback-Cursor`` header.
+
         :param key: your API key
         :param qid: the query identifier, can be "all"
         :param runid: *optional*, the runid
+        :query since: *optional*, the cursor of a previous response
+        :reqheader Accept: *optional*, ``application/x-ndjson`` to stream
+        :resheader X-Feedback-Cursor: the cursor, when streaming
         :status 403: invalid key
         :status 404: query does not exist
         :status 400: bad request
@@ -66,8 +82,10 @@ class Feedback(ApiResource):
             .. sourcecode:: javascript
 
                 {
+                    "cursor": "1398606360000",
                     "feedback": [
-                        {"qid": "S-q1",
+                        {"sid": "S-s1",
+                         "qid": "S-q1",
                          "runid": "baseline",
                          "modified_time": "Sun, 27 Apr 2014 13:46:00 -0000",
                          "doclist": [
@@ -109,11 +127,22 @@ class Feedback(ApiResource):
         """
 
         self.validate_participant(key)
+        since = request.args.get("since")
+        cursor = core.feedback.get_feedback_cursor()
         feedbacks = self.trycall(core.feedback.get_feedback,
                                  userid=key,
                                  qid=qid,
-                                 runid=runid)
-        return {"feedback": [marshal(feedback, feedback_fields)
+                                 runid=runid,
+                                 since=since,
+                                 until=cursor if since else None)
+        if self.wants_ndjson():
+            response = self.stream_ndjson(feedbacks, feedback_fields)
+            response.headers["X-Feedback-Cursor"] = cursor
+            return response
+        # Read the cursor here, so query errors become a 400
+        feedbacks = self.trycall(list, feedbacks)
+        return {"cursor": cursor,
+                "feedback": [marshal(feedback, feedback_fields)
                              for feedback in feedbacks]}
 
     def delete(self, key, qid, runid=None):
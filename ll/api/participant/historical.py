@@ -66,7 +66,7 @@ class Historical(ApiResource):
 
         self.validate_participant(key)
         feedbacks = self.trycall(core.feedback.get_historical_feedback,
-                                 qid=qid)
+                                 qid=qid, secondary=True)
         return {"feedback": [marshal(feedback, feedback_fields)
                              for feedback in feedbacks]}
 
@@ -99,7 +99,7 @@ class Outcome(ApiResource):
         """
 
         self.validate_participant(key)
-        outcomes = self.trycall(core.feedback.get_comparison,
+        outcomes = self.trycall(core.feedback.get_outcomes,
                                 key,
                                 qid=qid)
 
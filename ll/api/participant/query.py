@@ -37,8 +37,13 @@ class Query(ApiResource):
         participants will (should) not expect any feedback for them. The
         default query type is "train".
 
+        Responses carry an ETag and Last-Modified header. Send them back in
+        If-None-Match or If-Modified-Since to get an empty 304 response when
+        nothing changed.
+
         :param key: your API key
         :status 200: valid key
+        :status 304: query set did not change
         :status 403: invalid key
         :return:
             .. sourcecode:: javascript
@@ -62,9 +67,13 @@ class Query(ApiResource):
 
         """
         self.validate_participant(key)
+        headers, not_modified = self.check_version(
+            self.trycall(core.query.get_query_version, key))
+        if not_modified:
+            return not_modified
         queries = self.trycall(core.query.get_query, key=key)
         return {"queries": [marshal(q, query_fields) for q in queries
-                            if "doclist" in q]}
+                            if "doclist" in q]}, 200, headers
 
 api.add_resource(Query, '/api/participant/query/<key>',
                  endpoint="participant/query")
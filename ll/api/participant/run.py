@@ -36,9 +36,14 @@ class Run(ApiResource):
         """
         Obtain the last submitted run (ranking) for a specific query.
 
+        Responses carry an ETag and Last-Modified header. Send them back in
+        If-None-Match or If-Modified-Since to get an empty 304 response when
+        nothing changed.
+
         :param key: your API key
         :param qid: the query identifier
         :status 200: valid key
+        :status 304: run did not change
         :status 403: invalid key
 
         :return:
@@ -60,8 +65,12 @@ class Run(ApiResource):
 
         """
         self.validate_participant(key)
+        headers, not_modified = self.check_version(
+            self.trycall(core.run.get_run_version, key, qid))
+        if not_modified:
+            return not_modified
         run = self.trycall(core.run.get_run, key, qid)
-        return marshal(run, run_fields)
+        return marshal(run, run_fields), 200, headers
 
     def put(self, key, qid):
         """
@@ -108,5 +117,98 @@ class Run(ApiResource):
         run = self.trycall(core.run.add_run, key, qid, run["runid"], run["doclist"])
         return marshal(run, run_fields)
 
+
+class Runs(ApiResource):
+    def put(self, key):
+        """
+        Submit runs for many queries at once. This is equivalent to a
+        :http:put:`/api/participant/run/(key)/(qid)` for each run, but takes
+        a single request. The same rules apply to each run; a run that is
+        rejected does not keep the others from being stored.
+
+        The runs can be sent as one JSON array, or as an object with a
+        "runs" array. Each run needs a qid, at most one run per query.
+
+        :param key: your API key
+
+        :reqheader Content-Type: application/json
+        :content:
+            .. sourcecode:: javascript
+
+                {
+                    "runs": [
+                        {
+                            "qid": "U-q22",
+                            "runid": "82",
+                            "doclist": [
+                                {
+                                    "docid": "U-d4"
+                                },
+                                {
+                                    "docid": "U-d2"
+                                }, ...
+                            ]
+                        }, ...
+                    ]
+                }
+
+        :status 200: valid key, see the status of each run
+        :status 403: invalid key
+        :status 400: bad request
+        :return: the status of each run, in the order they were sent. The
+            status is the one :http:put:`/api/participant/run/(key)/(qid)`
+            would have returned for the run: 200 if it was stored, 400 if
+            a field is missing, 404 if the query or a document does not
+            exist and 409 if the run can only be uploaded once.
+
+            .. sourcecode:: javascript
+
+                {
+                    "runs": [
+                        {
+                            "qid": "U-q22",
+                            "runid": "82",
+                            "status": 200
+                        },
+                        {
+                            "qid": "U-q23",
+                            "runid": "82",
+                            "status": 409,
+                            "message": "For test queries you can only ..."
+                        }, ...
+                    ]
+                }
+
+        """
+        self.validate_participant(key)
+        runs = request.get_json(force=True)
+        if isinstance(runs, dict):
+            self.check_fields(runs, ["runs"])
+            runs = runs["runs"]
+        if not isinstance(runs, list):
+            self.abort(400, "Please send a list of runs.")
+        # Runs with missing fields get a 400 status of their own
+        results = self.trycall(core.run.add_runs, key, runs)
+        return {"runs": [self.run_status(run, error)
+                         for run, error in results]}
+
+    def run_status(self, run, error):
+        status = {"qid": None, "runid": None, "status": 200}
+        if isinstance(run, dict):
+            status["qid"] = run.get("qid")
+            status["runid"] = run.get("runid")
+        if isinstance(error, ValueError):
+            status["status"] = 409
+        elif isinstance(error, LookupError):
+            status["status"] = 404
+        elif error is not None:
+            status["status"] = 400
+        if error is not None:
+            status["message"] = str(error)
+        return status
+
+
 api.add_resource(Run, '/api/participant/run/<key>/<qid>',
                  endpoint="participant/run")
+api.add_resource(Runs, '/api/participant/runs/<key>',
+                 endpoint="participant/runs")
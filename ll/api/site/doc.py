@@ -13,6 +13,7 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with Living Labs Challenge. If not, see <http://www.gnu.org/licenses/>.
 
+import json
 from flask import request
 from flask.ext.restful import fields, marshal
 from .. import api
@@ -32,6 +33,9 @@ doclist_fields_relevance_signals = {
     "docid": fields.String(attribute="_id"),
 }
 
+# Only these fields are read from the database for doclists
+doclist_projection = ["site_docid", "title"]
+
 doc_fields = {
     "site_docid": fields.String(),
     "creation_time": fields.DateTime(),
@@ -136,8 +140,13 @@ class DocList(ApiResource):
         You are free to update this list when the set of documents changes over
         time.
 
+        Responses carry an ETag and Last-Modified header. Send them back in
+        If-None-Match or If-Modified-Since to get an empty 304 response when
+        nothing changed.
+
         :param key: your API key
         :param site_qid: the site's query identifier
+        :status 304: doclist did not change
         :status 403: invalid key
         :status 404: query does not exist or does not have a doclist attached
         :status 400: bad request
@@ -157,14 +166,20 @@ class DocList(ApiResource):
         list.
         """
         site_id = self.get_site_id(key)
+        headers, not_modified = self.check_version(
+            self.trycall(core.doc.get_doclist_version, site_id=site_id,
+                         site_qid=site_qid))
+        if not_modified:
+            return not_modified
         doclist = self.trycall(core.doc.get_doclist, site_id=site_id,
-                               site_qid=site_qid)
+                               site_qid=site_qid,
+                               projection=doclist_projection)
         return {
             "site_qid": site_qid,
             "doclist": [marshal(d, doclist_fields_relevance_signals)
                 if "relevance_signals" in d else marshal(d, doclist_fields)
                 for d in doclist]
-            }
+            }, 200, headers
 
     def put(self, key, site_qid):
         """
@@ -200,7 +215,8 @@ class DocList(ApiResource):
         documents = request.get_json(force=True)
         self.check_fields(documents, ["doclist"])
         doclist = self.trycall(core.doc.add_doclist, site_id, site_qid,
-                               documents["doclist"])
+                               documents["doclist"],
+                               projection=doclist_projection)
         return {
             "site_qid": site_qid,
             "doclist": [marshal(d, doclist_fields_relevance_signals)
@@ -208,7 +224,91 @@ class DocList(ApiResource):
                 for d in doclist]
             }
 
+class Docs(ApiResource):
+    def put(self, key):
+        """
+        Store many documents at once. This is equivalent to a
+        :http:put:`/api/site/doc/(key)/(site_docid)` for each document, but
+        takes a single request.
+
+        The documents can be sent as one JSON array (or as an object with a
+        "docs" array), or as newline delimited
+        JSON (one document per line) with the
+        ``Content-Type: application/x-ndjson`` header. The latter is read
+        and stored in batches while it is being received, which is advised
+        for large document collections. A JSON body is checked as a whole, so
+        if a document is invalid none is stored. Newline delimited JSON is
+        checked and stored per batch of 1000 documents, so if a document is
+        invalid the batches that came before it are stored.
+
+        :param key: your API key
+
+        :reqheader Content-Type: application/json or application/x-ndjson
+        :content:
+            .. sourcecode:: javascript
+
+                [
+                    {
+                         "content": {"description": "Lorem ipsum dolor sit amet",
+                                     "short_description" : "Lorem ipsum",
+                                     ...}
+                         "site_docid": "b59b2e327493c4fdb24296a90a20bdd20e40e737",
+                         "title": "Document Title"
+                    },
+                    ...
+                ]
+
+        :status 200: stored the documents
+        :status 403: invalid key
+        :status 400: bad request
+        :return:
+            .. sourcecode:: javascript
+
+                {
+                    "inserted": 980,
+                    "updated": 20
+                }
+        """
+        site_id = self.get_site_id(key)
+        result = {"inserted": 0, "updated": 0}
+        for docs in self.read_docs():
+            stored = self.trycall(core.doc.add_docs, site_id, docs)
+            result["inserted"] += stored["inserted"]
+            result["updated"] += stored["updated"]
+        return result
+
+    def read_docs(self, batch_size=1000):
+        if request.mimetype == "application/x-ndjson":
+            docs = []
+            for line in request.stream:
+                if not line.strip():
+                    continue
+                try:
+                    doc = json.loads(line)
+                except ValueError:
+                    self.abort(400, "Invalid JSON on line: '%s'."
+                               % line.strip()[:100])
+                docs.append(self.check_fields(doc, ["site_docid", "title",
+                                                    "content"]))
+                if len(docs) == batch_size:
+                    yield docs
+                    docs = []
+            if docs:
+                yield docs
+        else:
+            docs = request.get_json(force=True)
+            if isinstance(docs, dict):
+                self.check_fields(docs, ["docs"])
+                docs = docs["docs"]
+            for doc in docs:
+                self.check_fields(doc, ["site_docid", "title", "content"])
+            for i in range(0, len(docs), batch_size):
+                yield docs[i:i + batch_size]
+
+
 api.add_resource(Doc, '/api/site/doc/<key>/<site_docid>',
                  endpoint="site/doc")
+api.add_resource(Docs, '/api/site/docs/<key>',
+                 endpoint="site/docs")
 api.add_resource(DocList, '/api/site/doclist/<key>/<site_qid>',
                  endpoint="site/doclist")
@@ -42,6 +42,7 @@ class Client():
 
         args, _ = self.parser.parse_known_args()
 
+        self.cache = {}
         self.wait_max = args.wait_max
         self.wait_min = args.wait_min
         self.host = "%s:%s/api" % (args.host, args.port)
@@ -54,14 +55,28 @@ class Client():
         time.sleep(wait_min + (random.random() * (wait_max - wait_min)))
 
     def get(self, url, tries=0):
-        r = requests.get(url, headers=HEADERS)
+        # Responses with an ETag or Last-Modified header are kept, and
+        # revalidated on the next request for the same url
+        headers = dict(HEADERS)
+        cached = self.cache.get(url)
+        if cached is not None:
+            if "ETag" in cached.headers:
+                headers["If-None-Match"] = cached.headers["ETag"]
+            if "Last-Modified" in cached.headers:
+                headers["If-Modified-Since"] = cached.headers["Last-Modified"]
+        r = requests.get(url, headers=headers)
         if r.status_code == requests.codes.too_many_requests and tries < 15:
             self.sleep(tries + 1)
             return self.get(url, tries=tries + 1)
+        elif r.status_code == requests.codes.not_modified and cached:
+            self.sleep()
+            return cached
         elif r.status_code != requests.codes.ok:
             print r.text
             r.raise_for_status()
         else:
+            if "ETag" in r.headers or "Last-Modified" in r.headers:
+                self.cache[url] = r
             self.sleep()
         return r
 
@@ -77,11 +92,11 @@ class Client():
             self.sleep()
         return r
 
-    def put(self, url, data, tries=0):
-        r = requests.put(url, data=data, headers=HEADERS)
+    def put(self, url, data, tries=0, headers=HEADERS):
+        r = requests.put(url, data=data, headers=headers)
         if r.status_code == requests.codes.too_many_requests and tries < 15:
             self.sleep(tries + 1)
-            return self.put(url, data, tries=tries + 1)
+            return self.put(url, data, tries=tries + 1, headers=headers)
         elif r.status_code != requests.codes.ok:
             print r.text
             r.raise_for_status()
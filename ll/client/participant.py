@@ -25,6 +25,7 @@ QUERYENDPOINT    = "participant/query"
 DOCENDPOINT      = "participant/doc"
 DOCLISTENDPOINT  = "participant/doclist"
 RUNENDPOINT      = "participant/run"
+RUNSENDPOINT     = "participant/runs"
 FEEDBACKENDPOINT = "participant/feedback"
 
 
@@ -90,11 +91,15 @@ class Participant(Client):
         return r.json()
 
     # if qid == "all" returns feedback for all queries
-    def get_feedback(self, key, qid, runid=None):
+    # if since is the cursor of an earlier response, only returns feedback
+    # that changed after it
+    def get_feedback(self, key, qid, runid=None, since=None):
         urlList = [self.host, FEEDBACKENDPOINT, key, qid]
         if runid:
             urlList.append(str(runid))
         url = "/".join(urlList)
+        if since:
+            url += "?since=%s" % since
         r = self.get(url)
         return r.json()
 
@@ -105,19 +110,29 @@ class Participant(Client):
             url = "/".join([self.host, FEEDBACKENDPOINT, key, qid])
             self.delete(url)
 
-    def store_runs(self, key, runs):
-        for qid in runs:
-            run = runs[qid]
-            run["runid"] = str(self.runid)
-            url = "/".join([self.host, RUNENDPOINT, key, qid])
-            self.put(url, json.dumps(run))
+    # Runs are uploaded batch_size queries per request
+    def store_runs(self, key, runs, batch_size=100):
+        url = "/".join([self.host, RUNSENDPOINT, key])
+        qids = sorted(runs)
+        for i in range(0, len(qids), batch_size):
+            batch = []
+            for qid in qids[i:i + batch_size]:
+                run = runs[qid]
+                run["runid"] = str(self.runid)
+                batch.append({"qid": qid,
+                              "runid": run["runid"],
+                              "doclist": run["doclist"]})
+            r = self.put(url, json.dumps({"runs": batch}))
+            for status in r.json()["runs"]:
+                if status["status"] != 200:
+                    print status["qid"], status["message"]
 
     def update_runs(self, key, runs, feedbacks):
         for qid in runs:
             if qid in feedbacks and feedbacks[qid]:
                 clicks = dict([(doc['docid'], 0)
                     for doc in runs[qid]['doclist']])
-                for feedback in feedbacks[qid]:
+                for feedback in feedbacks[qid].values():
                     for doc in feedback["doclist"]:
                         if doc["clicked"] and doc["docid"] in clicks:
                             clicks[doc["docid"]] += 1
@@ -144,6 +159,7 @@ class Participant(Client):
         for query in queries["queries"]:
             qid = query["qid"]
             runs[qid] = self.get_doclist(key, qid)
+        # Feedback per qid and sid, a session may receive more clicks later
         feedbacks = {}
         feedback_update = self.get_feedback(key, "all")
         for elem in feedback_update['feedback']:
@@ -151,14 +167,13 @@ class Participant(Client):
         i = 0
         while (n_iterations == -1 or i < n_iterations):
             for elem in feedback_update['feedback']:
-                qid = elem["qid"]
-                if qid in feedbacks:
-                    feedbacks[qid].append(elem)
-                else:
-                    feedbacks[qid] = [elem]
+                feedbacks.setdefault(elem["qid"], {})[elem["sid"]] = elem
             runs = self.update_runs(key, runs, feedbacks)
             self.sleep()
-            feedback_update = self.get_feedback(key, "all", self.runid)
+            # Only fetch the feedback for the current run that changed since
+            # the last poll
+            feedback_update = self.get_feedback(
+                key, "all", self.runid, since=feedback_update["cursor"])
             i += 1
 
     def get_train(self, key):
@@ -35,10 +35,14 @@ PSTOP = {0: 0.2,
 
 QUERYENDPOINT = "site/query"
 DOCENDPOINT = "site/doc"
+DOCSENDPOINT = "site/docs"
 DOCLISTENDPOINT = "site/doclist"
 RANKIGNENDPOINT = "site/ranking"
 FEEDBACKENDPOINT = "site/feedback"
 
+NDJSON_HEADERS = {'content-type': 'application/x-ndjson'}
+BULK_SIZE = 1000
+
 
 class Site(Client):
     def __init__(self):
@@ -69,6 +73,10 @@ class Site(Client):
         self.parser.add_argument('-d', '--store_doclist', action="store_true",
                             default=False,
                             help='Store a document list (needs --run_file)')
+        self.parser.add_argument('--bulk', action="store_true",
+                            default=False,
+                            help='Upload the documents for -d in bulk '
+                            'instead of one request per document.')
         self.parser.add_argument('--run_file',
                             default=os.path.normpath(os.path.join(path,
                                                     "../../data/run.txt")),
@@ -101,7 +109,8 @@ class Site(Client):
             if args.store_queries:
                 self.store_queries(args.key, args.query_file, args.query_type)
             if args.store_doclist:
-                self.store_doclist(args.key, args.run_file, args.docs_dir)
+                self.store_doclist(args.key, args.run_file, args.docs_dir,
+                                   args.bulk)
 
         if args.simulate_clicks:
             self.simulate_clicks(args.iterations, args.key, args.qrel_file,
@@ -144,26 +153,46 @@ class Site(Client):
         url = "/".join([self.host, QUERYENDPOINT, key])
         self.delete(url)
 
-    def store_doc(self, key, docid, site_docid, docdir):
+    def read_doc(self, docid, site_docid, docdir):
         fh = codecs.open(os.path.join(docdir, docid), "r", "utf-8")
         title = fh.readline().strip()
         content = fh.read().strip()
         fh.close()
-        doc = {
+        return {
             "site_docid": site_docid,
             "title": title,
             "content": {"text": content},
             }
+
+    def store_doc(self, key, docid, site_docid, docdir):
+        doc = self.read_doc(docid, site_docid, docdir)
         url = "/".join([self.host, DOCENDPOINT, key, site_docid])
         self.put(url, json.dumps(doc))
 
-    def store_doclist(self, key, run_file, docdir):
+    def store_docs(self, key, docids, docdir):
+        url = "/".join([self.host, DOCSENDPOINT, key])
+        for i in range(0, len(docids), BULK_SIZE):
+            ndjson = "\n".join(json.dumps(self.read_doc(docid, docid, docdir))
+                               for docid in docids[i:i + BULK_SIZE])
+            self.put(url, ndjson, headers=NDJSON_HEADERS)
+
+    def store_doclist(self, key, run_file, docdir, bulk=False):
         def put_doclist(doclist, current_qid):
             site_qid = current_qid
             doclist["site_qid"] = site_qid
             url = "/".join([self.host, DOCLISTENDPOINT, key, site_qid])
             self.put(url, json.dumps(doclist))
 
+        if bulk:
+            docids = []
+            seen = set()
+            for line in open(run_file, "r"):
+                docid = line.split()[2]
+                if docid not in seen:
+                    seen.add(docid)
+                    docids.append(docid)
+            self.store_docs(key, docids, docdir)
+
         doclist = {"doclist": []}
         current_qid = None
         for line in open(run_file, "r"):
@@ -172,10 +201,11 @@ class Site(Client):
                 put_doclist(doclist, current_qid)
                 doclist = {"doclist": []}
             site_docid = docid
-            self.store_doc(key, docid, site_docid, docdir)
+            if not bulk:
+                self.store_doc(key, docid, site_docid, docdir)
+                self.sleep()
             doclist["doclist"].append({"site_docid": site_docid})
             current_qid = qid
-            self.sleep()
         put_doclist(doclist, current_qid)
 
     def store_letor_doc(self, key, docid, site_docid):
@@ -13,5 +13,6 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with Living Labs Challenge. If not, see <http://www.gnu.org/licenses/>.
 
-__all__ = ["user", "query", "site", "doc", "feedback", "run"]
+__all__ = ["user", "query", "site", "doc", "feedback", "run", "pool",
+           "scheduler", "stats", "metrics", "jobs"]
 from . import *
@@ -53,5 +53,18 @@ config = {
     "RUN_AGE_THRESHOLD_DAYS": 30,
     "REACTIVATION_PERIOD_DAYS": 7,
     "SEND_EMAIL_RUN_OUTDATED": True,
-    "SEND_EMAIL_RUN_OUTDATED": True
+    "SEND_EMAIL_RUN_DELETED": True,
+    "RANKING_POOL_SECONDS": 60,
+    "SCHEDULE_FLUSH_SIZE": 100,
+    "SCHEDULE_FLUSH_SECONDS": 30,
+    "ID_BLOCK_SIZE": 1000,
+    "SESSION_FLUSH_SIZE": 100,
+    "SESSION_FLUSH_SECONDS": 5,
+    "DOCID_CACHE_SIZE": 100000,
+    "STATS_FLUSH_SIZE": 100,
+    "STATS_FLUSH_SECONDS": 10,
+    "STATS_CACHE_SECONDS": 30,
+    "FEEDBACK_CURSOR_DELAY_SECONDS": 5,
+    "USER_CACHE_SECONDS": 10,
+    "WORKER_LEASE_SECONDS": 60,
 }
@@ -13,30 +13,173 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with Living Labs Challenge. If not, see <http://www.gnu.org/licenses/>.
 
-from pymongo import MongoClient
+from pymongo import MongoClient, ReadPreference, ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
 from collections import OrderedDict
 import subprocess
 import json
 import os
 
 class CoreDatabase(object):
+    """
+    The database shared by all core modules. Reads and writes go to the
+    primary; reads that may be slightly stale, such as the docs, queries and
+    historical feedback served to participants, can use db.secondary, which
+    prefers secondaries when read_secondary is enabled.
+    """
     def __init__(self):
         self.db = None
+        self.secondary = None
 
     def __getattr__(self, name):
         return self.db.__getattr__(name)
 
-    def init_db(self, host, port, db_name, user=None, password=None, authenticationDatabase=None):
+    def init_db(self, host, port, db_name, user=None, password=None,
+                authenticationDatabase=None, max_pool_size=100,
+                connect_timeout_ms=20000, socket_timeout_ms=None,
+                server_selection_timeout_ms=30000, write_concern=None,
+                read_secondary=False):
         #print("Initialize db ", db_name, "with user", user, "and password", password, "on authbase", authenticationDatabase)
         if self.db == None:
-            client = MongoClient(host, port)
+            options = {"maxPoolSize": max_pool_size,
+                       "connectTimeoutMS": connect_timeout_ms,
+                       "socketTimeoutMS": socket_timeout_ms,
+                       "serverSelectionTimeoutMS": server_selection_timeout_ms}
+            if write_concern:
+                # Either a number of nodes or a tag such as "majority"
+                options["w"] = int(write_concern) \
+                    if str(write_concern).isdigit() else write_concern
+            client = MongoClient(host, port, **options)
             self.db = client[db_name]
+            if read_secondary:
+                self.secondary = client.get_database(
+                    db_name,
+                    read_preference=ReadPreference.SECONDARY_PREFERRED)
+            else:
+                self.secondary = self.db
             if user and password:
                 #print("Now really logging in with", user, "and", password, "on", authenticationDatabase)
                 self.db.authenticate(user, password, source=authenticationDatabase)
 
 db = CoreDatabase()
 
+# The indexes the core queries rely on, by collection.
+INDEXES = {
+    "doc": [
+        # add_doc, resolve_site_docids, get_docs
+        [("site_id", ASCENDING), ("site_docid", ASCENDING)],
+    ],
+    "query": [
+        # add_query, add_doclist, get_query
+        [("site_id", ASCENDING), ("site_qid", ASCENDING)],
+        # Recently changed doclists, for the cleanup
+        [("doclist_modified_time", ASCENDING)],
+    ],
+    "feedback": [
+        # reset_feedback and get_test_feedback for a query, of any type
+        [("qid", ASCENDING), ("site_id", ASCENDING), ("userid", ASCENDING)],
+        # get_feedback, get_test_feedback and the comparison pipeline
+        [("userid", ASCENDING), ("qtype", ASCENDING), ("qid", ASCENDING)],
+        [("site_id", ASCENDING), ("userid", ASCENDING), ("qtype", ASCENDING)],
+        # get_feedback with a since cursor
+        [("userid", ASCENDING), ("qtype", ASCENDING),
+         ("modified_time", ASCENDING)],
+    ],
+    "run": [
+        # add_run, get_run, get_trec, the ranking pool and the cleanup
+        [("userid", ASCENDING), ("qid", ASCENDING), ("runid", ASCENDING)],
+        # Most recent runs on the admin dashboard
+        [("site_id", ASCENDING), ("creation_time", DESCENDING)],
+    ],
+    "active_run": [
+        # The ranking pool, the active runs of a query
+        [("qid", ASCENDING)],
+        # The active runs of a participant
+        [("userid", ASCENDING), ("site_id", ASCENDING)],
+        # Cleanup candidates
+        [("creation_time", ASCENDING)],
+    ],
+    "historical": [
+        # Site and participant historical feedback
+        [("site_id", ASCENDING), ("site_qid", ASCENDING)],
+        [("qid", ASCENDING)],
+    ],
+    "outcome": [
+        [("userid", ASCENDING), ("qid", ASCENDING)],
+    ],
+    "user": [
+        [("email", ASCENDING)],
+    ],
+}
+
+
+# Indexes in INDEXES that have to be unique. Upserts on these keys can then
+# not create duplicates when they race.
+UNIQUE_INDEXES = {
+    "run": [
+        [("userid", ASCENDING), ("qid", ASCENDING), ("runid", ASCENDING)],
+    ],
+}
+
+
+def _get_indexes(coll):
+    return [(index["key"].items(), bool(index.get("unique")))
+            for index in coll.list_indexes()]
+
+
+def ensure_indexes():
+    """
+    Creates the indexes in INDEXES that do not exist yet. Returns the names
+    of the indexes that were created.
+    """
+    created = []
+    for collection, indexes in sorted(INDEXES.items()):
+        coll = db.db[collection]
+        existing = _get_indexes(coll)
+        for keys in indexes:
+            unique = keys in UNIQUE_INDEXES.get(collection, [])
+            if (keys, unique) in existing:
+                continue
+            try:
+                name = coll.create_index(keys, background=True, unique=unique)
+            except OperationFailure as e:
+                # E.g. a non-unique index on the same keys, or duplicates
+                print("Could not create index on %s %s: %s" %
+                      (collection, keys, e))
+                continue
+            created.append("%s.%s" % (collection, name))
+    return created
+
+
+def get_index_report():
+    """
+    Compares the indexes in the database with INDEXES. Returns per
+    collection the indexes that are missing, the indexes that are not in
+    INDEXES and the indexes that were not used since the server started.
+    Usage is only known on MongoDB 3.2 and up; it is None otherwise.
+    """
+    report = {}
+    for collection, indexes in sorted(INDEXES.items()):
+        coll = db.db[collection]
+        existing = dict((index["name"], index["key"].items())
+                        for index in coll.list_indexes())
+        try:
+            usage = dict((s["name"], s["accesses"]["ops"])
+                         for s in coll.aggregate([{"$indexStats": {}}]))
+        except OperationFailure:
+            usage = None
+        unique = UNIQUE_INDEXES.get(collection, [])
+        report[collection] = {
+            "missing": [keys for keys in indexes
+                        if (keys, keys in unique) not in _get_indexes(coll)],
+            "unregistered": sorted(name for name, keys in existing.items()
+                                   if name != "_id_" and keys not in indexes),
+            "unused": None if usage is None else
+            sorted(name for name in existing
+                   if name != "_id_" and not usage.get(name)),
+        }
+    return report
+
 
 def clear():
     db.user.remove({})
@@ -89,7 +232,7 @@ def export_json(path, host, port, database, username, password, authentication_d
 
 def import_json(path, host, port, database, username, password, authentication_database):
     # Loop over all collections, they have their own json-file and json-metafile
-    for collection in ["doc","feedback","historical","query","run","site","system","user"]:
+    for collection in ["doc","feedback","historical","query","run","site","system","user","outcome","active_run"]:
         json_file=os.path.join(path,database,collection)+".json"
 
         # Import json database file for this collection
@@ -129,3 +272,7 @@ def import_metadata(path,database,collection):
                 db.query.create_index(index.items())
             elif(collection==u"historical"):
                 db.historical.create_index(index.items())
+            elif(collection==u"outcome"):
+                db.outcome.create_index(index.items())
+            elif(collection==u"active_run"):
+                db.active_run.create_index(index.items())
@@ -14,39 +14,139 @@
 # along with Living Labs Challenge. If not, see <http://www.gnu.org/licenses/>.
 
 import datetime
+import threading
+from collections import OrderedDict
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
 from db import db
+from config import config
 import site
 import user
+import stats
 
 
-def add_doclist(site_id, site_qid, doclist):
+class DocidCache(object):
+    """
+    Bounded LRU mapping between the site_docids and docids of one site.
+    Only documents that are not deleted are kept. The ids of a document never
+    change, but a document can be deleted by another process, so lookups
+    that leave out deleted documents do not trust this cache.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.docids = OrderedDict()
+        self.site_docids = OrderedDict()
+
+    def get_docid(self, site_docid):
+        docid = self.docids.pop(site_docid, None)
+        if docid is not None:
+            self.docids[site_docid] = docid
+        return docid
+
+    def get_site_docid(self, docid):
+        site_docid = self.site_docids.pop(docid, None)
+        if site_docid is not None:
+            self.site_docids[docid] = site_docid
+        return site_docid
+
+    def add(self, site_docid, docid):
+        self.docids.pop(site_docid, None)
+        self.site_docids.pop(docid, None)
+        self.docids[site_docid] = docid
+        self.site_docids[docid] = site_docid
+        while len(self.docids) > self.size:
+            self.docids.popitem(last=False)
+        while len(self.site_docids) > self.size:
+            self.site_docids.popitem(last=False)
+
+    def remove(self, site_docid):
+        docid = self.docids.pop(site_docid, None)
+        if docid is not None:
+            self.site_docids.pop(docid, None)
+
+
+_docid_caches = {}
+_docid_lock = threading.Lock()
+
+
+def _docid_cache(site_id):
+    if site_id not in _docid_caches:
+        _docid_caches[site_id] = DocidCache(config["DOCID_CACHE_SIZE"])
+    return _docid_caches[site_id]
+
+
+def _resolve(site_id, ids, field, include_deleted):
+    # Maps ids in field ("site_docid" or "_id") to the other identifier, with
+    # one query for everything that is not cached yet. Without
+    # include_deleted, all ids are read, see DocidCache.
+    other = "_id" if field == "site_docid" else "site_docid"
+    resolved = {}
+    if include_deleted:
+        with _docid_lock:
+            cache = _docid_cache(site_id)
+            for i in ids:
+                found = cache.get_docid(i) if field == "site_docid" \
+                    else cache.get_site_docid(i)
+                if found is not None:
+                    resolved[i] = found
+    missing = list(set(ids) - set(resolved))
+    if not missing:
+        return resolved
+    q = {"site_id": site_id, field: {"$in": missing}}
+    if not include_deleted:
+        q["deleted"] = {"$ne": True}
+    docs = list(db.doc.find(q, {"site_docid": True, "deleted": True}))
+    with _docid_lock:
+        cache = _docid_cache(site_id)
+        for d in docs:
+            resolved[d[field]] = d[other]
+            if not d.get("deleted"):
+                cache.add(d["site_docid"], d["_id"])
+            else:
+                cache.remove(d["site_docid"])
+    return resolved
+
+
+def resolve_site_docids(site_id, site_docids, include_deleted=False):
+    """Returns a dict mapping each known site_docid to its docid."""
+    return _resolve(site_id, site_docids, "site_docid", include_deleted)
+
+
+def resolve_docids(site_id, docids, include_deleted=True):
+    """Returns a dict mapping each known docid to its site_docid."""
+    return _resolve(site_id, docids, "_id", include_deleted)
+
+
+def add_doclist(site_id, site_qid, doclist, projection=None):
     query = db.query.find_one({"site_id": site_id, "site_qid": site_qid})
     if query is None:
         raise LookupError("Query not found: site_qid = '%s'. Add queries "
                           "before adding a doclist." % site_qid)
+    docids = resolve_site_docids(site_id, [d["site_docid"] for d in doclist])
     store_doclist = []
     for doc in doclist:
-        doc_found = get_doc(site_id=site_id, site_docid=doc["site_docid"])
-        if not doc_found:
+        if doc["site_docid"] not in docids:
             raise ValueError("Document not found: site_docid = '%s'. Add "
                              "documents before adding a doclist."
                              % doc["site_docid"])
         if "relevance_signals" in doc:
             # szn extension: store relevance signals for this doclist item
             store_doclist.append({
-                "_id": doc_found["_id"],
+                "_id": docids[doc["site_docid"]],
                 "relevance_signals": doc["relevance_signals"],
                 })
         else:
-            store_doclist.append(doc_found["_id"])
+            store_doclist.append(docids[doc["site_docid"]])
 
     query["doclist"] = store_doclist
     query["doclist_modified_time"] = datetime.datetime.now()
     db.query.save(query)
-    return get_doclist(site_id=site_id, site_qid=site_qid)
+    return get_doclist(site_id=site_id, site_qid=site_qid,
+                       projection=projection)
 
 
-def get_doclist(site_id=None, site_qid=None, qid=None, key=None):
+def _find_doclist_query(site_id=None, site_qid=None, qid=None, key=None,
+                        projection=None):
     q = {}
     if key:
         sites = user.get_sites(key)
@@ -61,29 +161,77 @@ def get_doclist(site_id=None, site_qid=None, qid=None, key=None):
         q["site_qid"] = site_qid
     if qid:
         q["_id"] = qid
-    query = db.query.find_one(q)
+    # Participants can do with a slightly stale copy
+    queries = db.secondary.query if key else db.query
+    query = queries.find_one(q, projection)
     if not query:
         if site_qid:
             raise LookupError("Query not found: site_qid = '%s'." % site_qid)
         else:
             raise LookupError("Query not found: qid = '%s'." % qid)
+    return query
+
+
+def _get_doclist_docids(query):
+    return [d if isinstance(d, basestring) else d["_id"]
+            for d in query["doclist"]]
+
+
+def get_doclist(site_id=None, site_qid=None, qid=None, key=None,
+                projection=None):
+    """
+    Returns the documents in the doclist of a query, in doclist order. The
+    documents are fetched with a single query, optionally limited to the
+    fields in projection.
+    """
+    query = _find_doclist_query(site_id, site_qid, qid, key)
+    docids = _get_doclist_docids(query)
+    docs = db.secondary.doc if key else db.doc
+    docs = dict((d["_id"], d)
+                for d in docs.find({"_id": {"$in": docids}}, projection))
     doclist = []
     for d in query["doclist"]:
         if isinstance(d, basestring):
-            doclist.append(db.doc.find_one({"_id": d}))
-        else:
-            item = db.doc.find_one({"_id": d["_id"]})
+            if d in docs:
+                doclist.append(docs[d])
+        elif d["_id"] in docs:
+            item = dict(docs[d["_id"]])
             item["relevance_signals"] = d["relevance_signals"]
             doclist.append(item)
     return doclist
 
 
+def get_doclist_version(site_id=None, site_qid=None, qid=None, key=None):
+    """
+    Returns the state and last modification time of a doclist, as used by
+    get_doclist, without reading the documents themselves.
+    """
+    query = _find_doclist_query(site_id, site_qid, qid, key,
+                                {"doclist": True,
+                                 "doclist_modified_time": True})
+    docids = _get_doclist_docids(query)
+    docs = db.secondary.doc if key else db.doc
+    docs_modified = None
+    for g in docs.aggregate([
+            {"$match": {"_id": {"$in": docids}}},
+            {"$group": {"_id": None,
+                        "modified": {"$max": "$creation_time"}}}]):
+        docs_modified = g["modified"]
+    modified = [t for t in [query.get("doclist_modified_time"), docs_modified]
+                if t is not None]
+    return ((query["_id"], len(docids), query.get("doclist_modified_time"),
+             docs_modified),
+            max(modified) if modified else None)
+
+
 def delete_doc(site_id, site_docid):
     existing_doc = db.doc.find_one({"site_id": site_id,
                                     "site_docid": site_docid})
     if existing_doc:
         existing_doc["deleted"] = True
         db.doc.save(existing_doc)
+        with _docid_lock:
+            _docid_cache(site_id).remove(site_docid)
         return True
     return False
 
@@ -97,6 +245,8 @@ def add_doc(site_id, site_docid, doc):
         existing_doc["creation_time"] = datetime.datetime.now()
         existing_doc["deleted"] = False
         db.doc.save(existing_doc)
+        with _docid_lock:
+            _docid_cache(site_id).add(site_docid, existing_doc["_id"])
         return existing_doc
     doc["_id"] = site.next_docid(site_id)
     doc["site_id"] = site_id
@@ -104,9 +254,62 @@ def add_doc(site_id, site_docid, doc):
     doc["creation_time"] = datetime.datetime.now()
     doc["deleted"] = False
     db.doc.insert(doc)
+    with _docid_lock:
+        _docid_cache(site_id).add(site_docid, doc["_id"])
+    stats.count_docs(site_id)
     return doc
 
 
+def add_docs(site_id, docs):
+    """
+    Stores docs with one ordered bulk write. If a document can not be
+    stored, the documents before it are, and an Exception names it.
+    """
+    existing = resolve_site_docids(site_id,
+                                   [doc["site_docid"] for doc in docs],
+                                   include_deleted=True)
+    requests = []
+    written = []
+    for doc in docs:
+        doc = dict(doc)
+        doc.pop("_id", None)
+        doc["creation_time"] = datetime.datetime.now()
+        doc["deleted"] = False
+        if doc["site_docid"] in existing:
+            requests.append(UpdateOne({"_id": existing[doc["site_docid"]]},
+                                      {"$set": doc}))
+            written.append((doc["site_docid"], existing[doc["site_docid"]],
+                            False))
+        else:
+            doc["_id"] = site.next_docid(site_id)
+            doc["site_id"] = site_id
+            existing[doc["site_docid"]] = doc["_id"]
+            requests.append(InsertOne(doc))
+            written.append((doc["site_docid"], doc["_id"], True))
+    error = None
+    if requests:
+        try:
+            db.doc.bulk_write(requests, ordered=True)
+        except BulkWriteError, e:
+            # An ordered write stops at the first document that fails
+            failed = e.details["writeErrors"][0]
+            error = Exception("Document not stored: site_docid = '%s' (%s). "
+                              "The documents before it were stored."
+                              % (written[failed["index"]][0],
+                                 failed["errmsg"]))
+            written = written[:failed["index"]]
+    with _docid_lock:
+        cache = _docid_cache(site_id)
+        for site_docid, docid, _ in written:
+            cache.add(site_docid, docid)
+    inserted = len([w for w in written if w[2]])
+    stats.count_docs(site_id, inserted)
+    if error is not None:
+        raise error
+    return {"inserted": inserted,
+            "updated": len(written) - inserted}
+
+
 def get_doc(site_id=None, site_docid=None, docid=None, key=None):
     q = {"deleted": {"$ne": True}}
     if key:
@@ -122,7 +325,8 @@ def get_doc(site_id=None, site_docid=None, docid=None, key=None):
         q["site_docid"] = site_docid
     if docid:
         q["_id"] = docid
-    return db.doc.find_one(q)
+    docs = db.secondary.doc if key else db.doc
+    return docs.find_one(q)
 
 
 def get_docs(site_id=None, site_docid=None, docid=None, key=None):
@@ -140,4 +344,5 @@ def get_docs(site_id=None, site_docid=None, docid=None, key=None):
         q["site_docid"] = site_docid
     if docid and docid.lower() != "all":
         q["_id"] = docid
-    return db.doc.find(q)
+    docs = db.secondary.doc if key else db.doc
+    return docs.find(q)
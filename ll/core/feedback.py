@@ -13,14 +13,105 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with Living Labs Challenge. If not, see <http://www.gnu.org/licenses/>.
 
-import datetime, pymongo
+import datetime
+import time
+import threading
+from collections import OrderedDict
 from bson import json_util
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
 from db import db
 from config import config
-import doc, query, user
+import doc, user, stats
 import json
 from pprint import pprint
 
+# Sessions created by get_ranking are buffered and written with a single
+# insert_many once SESSION_FLUSH_SIZE sessions are waiting or
+# SESSION_FLUSH_SECONDS have passed. add_feedback also looks in this buffer,
+# and in the sessions that are being written, so feedback for a session that
+# was not flushed yet is not lost.
+_sessions = OrderedDict()
+_flushing = {}
+_sessions_lock = threading.Lock()
+_sessions_flushed = time.time()
+
+
+def add_session(session):
+    with _sessions_lock:
+        _sessions[session["_id"]] = session
+        flush = (len(_sessions) >= config["SESSION_FLUSH_SIZE"] or
+                 time.time() - _sessions_flushed >
+                 config["SESSION_FLUSH_SECONDS"])
+    if flush:
+        flush_sessions()
+
+
+def flush_sessions():
+    global _sessions_flushed
+    with _sessions_lock:
+        sessions = _sessions.values()
+        _flushing.update(_sessions)
+        _sessions.clear()
+        _sessions_flushed = time.time()
+    if not sessions:
+        return
+    try:
+        db.feedback.insert_many(sessions, ordered=False)
+    except BulkWriteError, e:
+        # Sessions that already exist (code 11000) received feedback in the
+        # meantime, only retry the others.
+        failed = [sessions[error["index"]]
+                  for error in e.details["writeErrors"]
+                  if error["code"] != 11000]
+        _requeue_sessions(failed)
+        if failed:
+            raise
+    except Exception:
+        _requeue_sessions(sessions)
+        raise
+    finally:
+        with _sessions_lock:
+            for session in sessions:
+                _flushing.pop(session["_id"], None)
+
+
+def _requeue_sessions(sessions):
+    with _sessions_lock:
+        for session in sessions:
+            _sessions.setdefault(session["_id"], session)
+
+
+def _get_session(site_id, sid):
+    with _sessions_lock:
+        session = _sessions.get(sid, _flushing.get(sid))
+    if session is not None and session["site_id"] == site_id:
+        return dict(session)
+    return db.feedback.find_one({"site_id": site_id, "_id": sid})
+
+
+def _save_session(session):
+    """
+    Stores session and returns the doclist it replaced, or None if it had
+    none. Writes are swapped in atomically, so when processes save the same
+    session at once each of them gets the doclist of the write before it.
+    """
+    def replace():
+        return db.feedback.find_one_and_replace({"_id": session["_id"]},
+                                                session, {"doclist": True},
+                                                upsert=True)
+    try:
+        previous = replace()
+    except DuplicateKeyError:
+        # A concurrent save or flush inserted the session first
+        previous = replace()
+    # Only drop the buffered copy once the session is stored, a flush that
+    # runs in the meantime skips it as a duplicate
+    with _sessions_lock:
+        _sessions.pop(session["_id"], None)
+        _flushing.pop(session["_id"], None)
+    return previous.get("doclist") if previous else None
+
 
 
 def add_feedback_from_json(json_file,site_id, mongodb_host, mongodb_port, mongodb_db, mongodb_user, mongodb_user_pw, mongodb_auth_db):
@@ -62,24 +153,33 @@ def add_feedback_from_json(json_file,site_id, mongodb_host, mongodb_port, mongod
     return 0
 
 def add_feedback(site_id, sid, feedback):
-    existing_feedback = db.feedback.find_one({"site_id": site_id, "_id": sid})
+    existing_feedback = _get_session(site_id, sid)
     if existing_feedback is None:
         raise LookupError("Session not found: sid = '%s'." % sid)
-    for doc in feedback["doclist"]:
-        doc_found = db.doc.find_one({"site_id": site_id,
-                                     "site_docid": doc["site_docid"]
-                                     })
-        if not doc_found:
+    site_docids = [d["site_docid"] for d in feedback["doclist"]]
+    docids = doc.resolve_site_docids(site_id, site_docids,
+                                     include_deleted=True)
+    for d in feedback["doclist"]:
+        if d["site_docid"] not in docids:
             raise LookupError("Document not found: site_docid = '%s'. Please"
                             "only provide feedback for documents that are"
-                            "allowed for a query." % doc["site_docid"])
-        doc["docid"] = doc_found["_id"]
+                            "allowed for a query." % d["site_docid"])
+        d["docid"] = docids[d["site_docid"]]
 
     for k in feedback:
         existing_feedback[k] = feedback[k]
     
     existing_feedback["modified_time"] = datetime.datetime.now()
-    db.feedback.save(existing_feedback)
+    # Count the change from the doclist this save replaced, not the one read
+    # above, which another process may have replaced in the meantime
+    old_doclist = _save_session(existing_feedback)
+    clicks = stats.get_clicks(feedback["doclist"]) - \
+        stats.get_clicks(old_doclist or [])
+    old_outcome = _get_outcome({"doclist": old_doclist}) \
+        if old_doclist is not None else None
+    stats.count_clicks(existing_feedback["userid"], site_id, clicks)
+    _update_outcome(existing_feedback, old_outcome,
+                    _get_outcome(existing_feedback))
     return existing_feedback
 
 
@@ -88,16 +188,16 @@ def add_historical_feedback(site_id, site_qid, feedback):
     if query is None:
         raise LookupError("Query not found: site_qid = '%s'." % site_qid)
 
-    for doc in feedback["doclist"]:
-        doc_found = db.doc.find_one({"site_id": site_id,
-                                     "site_docid": doc["site_docid"]
-                                     })
-        if not doc_found:
+    site_docids = [d["site_docid"] for d in feedback["doclist"]]
+    docids = doc.resolve_site_docids(site_id, site_docids,
+                                     include_deleted=True)
+    for d in feedback["doclist"]:
+        if d["site_docid"] not in docids:
             raise LookupError("Document not found: site_docid = '%s'. Please"
                               "only provide historical feedback for documents"
                               "that are allowed for a query."
-                              % doc["site_docid"])
-        doc["docid"] = doc_found["_id"]
+                              % d["site_docid"])
+        d["docid"] = docids[d["site_docid"]]
 
     feedback["site_id"] = site_id
     feedback["site_qid"] = site_qid
@@ -119,11 +219,45 @@ def reset_feedback(userid=None, site_id=None, sid=None, qid=None):
         q["sid"] = sid
     if qid:
         q["qid"] = qid
-    db.feedback.remove(q)
-
-
-def get_feedback(userid=None, site_id=None, sid=None, qid=None, runid=None):
-    q = {"doclist": {"$exists": True}}
+    sessions = [f for f in db.feedback.find(q, {"userid": True,
+                                                "site_id": True, "qid": True,
+                                                "qtype": True,
+                                                "creation_time": True,
+                                                "doclist": True})]
+    for i in range(0, len(sessions), 1000):
+        db.feedback.remove({"_id": {"$in": [f["_id"] for f in
+                                            sessions[i:i + 1000]]}})
+    _remove_outcomes([f for f in sessions if "doclist" in f])
+
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def get_feedback_cursor():
+    """
+    Returns an opaque token for the current time, for use as since in
+    get_feedback. The token lags FEEDBACK_CURSOR_DELAY_SECONDS behind, so
+    feedback that is still being written is not skipped.
+    """
+    d = datetime.datetime.now() - _EPOCH - \
+        datetime.timedelta(seconds=config["FEEDBACK_CURSOR_DELAY_SECONDS"])
+    return str((d.days * 86400 + d.seconds) * 1000 + d.microseconds // 1000)
+
+
+def _cursor_time(cursor):
+    try:
+        return _EPOCH + datetime.timedelta(milliseconds=int(cursor))
+    except ValueError:
+        raise Exception("Invalid cursor: '%s'." % cursor)
+
+
+def get_feedback(userid=None, site_id=None, sid=None, qid=None, runid=None,
+                 since=None, until=None):
+    """
+    Returns a cursor over the feedback for training queries, optionally only
+    the feedback modified after cursor since and up to cursor until.
+    """
+    q = {"doclist": {"$exists": True}, "qtype": "train"}
     if userid:
         q["userid"] = userid
     if site_id:
@@ -134,35 +268,19 @@ def get_feedback(userid=None, site_id=None, sid=None, qid=None, runid=None):
         q["qid"] = qid
     if runid:
         q["runid"] = runid
-
-    if "qid" in q and "site_id" in q and "userid" in q:
-        feedbacks = db.feedback.find(q).hint([("qid", pymongo.ASCENDING),
-                                              ("site_id", pymongo.ASCENDING),
-                                              ("userid", pymongo.ASCENDING)
-                                              ])
-    elif "site_id" in q and "userid" in q:
-        feedbacks = db.feedback.find(q).hint([("site_id", pymongo.ASCENDING),
-                                              ("userid", pymongo.ASCENDING)
-                                              ])
-    else:
-        feedbacks = db.feedback.find(q)
-
-    readyfeedback = []
-    qid_types = {}
-    for feedback in feedbacks:
-        qid = feedback["qid"]
-        if qid not in qid_types:
-            query = db.query.find_one({"_id": qid})
-            if query and "type" in query and query["type"] == "test":
-                qid_types[qid] = "test"
-            else:
-                qid_types[qid] = "train"
-        if qid_types[qid] == "train":
-            readyfeedback.append(feedback)
-    return readyfeedback
+    if since is not None:
+        q.setdefault("modified_time", {})["$gt"] = _cursor_time(since)
+    if until is not None:
+        q.setdefault("modified_time", {})["$lte"] = _cursor_time(until)
+    return db.feedback.find(q)
 
 
 def get_test_feedback(userid=None, site_id=None, qid=None, qtype=None, runid=None):
+    """
+    Returns a cursor over the feedback, optionally only for queries of qtype
+    ("test" or "train"). Feedback for deleted queries is left out when
+    filtering on qtype.
+    """
     q = {"doclist": {"$exists": True}}
     if userid:
         q["userid"] = userid
@@ -175,88 +293,184 @@ def get_test_feedback(userid=None, site_id=None, qid=None, qtype=None, runid=Non
     if runid:
         q["runid"] = runid
 
-    if "qid" in q and "site_id" in q and "userid" in q:
-        feedbacks = db.feedback.find(q).hint([("qid", pymongo.ASCENDING),
-                                              ("site_id", pymongo.ASCENDING),
-                                              ("userid", pymongo.ASCENDING)
-                                              ])
-    elif "site_id" in q and "userid" in q:
-        feedbacks = db.feedback.find(q).hint([("site_id", pymongo.ASCENDING),
-                                              ("userid", pymongo.ASCENDING)
-                                              ])
-    else:
-        feedbacks = db.feedback.find(q)
-
     if qtype is not None:
+        q["qtype"] = qtype
+        deleted = _get_deleted_qids([site_id] if site_id else None)
+        if "qid" in q:
+            if q["qid"] in deleted:
+                q["qid"] = {"$in": []}
+        elif deleted:
+            q["qid"] = {"$nin": deleted}
+    return db.feedback.find(q)
+
+
+def _get_deleted_qids(site_ids=None):
+    q = {"deleted": True}
+    if site_ids is not None:
+        q["site_id"] = {"$in": site_ids}
+    return db.query.distinct("_id", q)
+
+
+def get_qtype(query):
+    return "test" if query and query.get("type") == "test" else "train"
+
+
+def set_qtype(qid, query_type):
+    """Updates the qtype of all feedback for a query whose type changed."""
+    qtype = get_qtype({"type": query_type})
+    flush_sessions()
+    db.feedback.update_many({"qid": qid, "qtype": {"$ne": qtype}},
+                            {"$set": {"qtype": qtype}})
+
+
+def set_qtypes(site_id=None):
+    """
+    Stores the type of the query on all feedback, for sessions that were
+    created before get_ranking did so. Returns the number of updated
+    documents.
+    """
+    q = {"site_id": site_id} if site_id else {}
+    qids = {"test": [], "train": []}
+    for query in db.query.find(q, {"type": True}):
+        qids[get_qtype(query)].append(query["_id"])
+    updated = 0
+    for qtype in qids:
+        for i in range(0, len(qids[qtype]), 1000):
+            result = db.feedback.update_many(
+                {"qid": {"$in": qids[qtype][i:i + 1000]},
+                 "qtype": {"$ne": qtype}},
+                {"$set": {"qtype": qtype}})
+            updated += result.modified_count
+    # Feedback for unknown queries has always been treated as training
+    q["qtype"] = {"$exists": False}
+    updated += db.feedback.update_many(q, {"$set": {"qtype": "train"}})\
+        .modified_count
+    return updated
+
+
+def _clicked(d):
+    return "clicked" in d and (d["clicked"] is True or
+                               (isinstance(d["clicked"], list) and
+                                len(d["clicked"]) > 0))
+
+
+def _get_outcome(feedback):
+    participant_wins = 0
+    site_wins = 0
+    for d in feedback["doclist"]:
+        if _clicked(d):
+            if "team" in d and d["team"] == "participant":
+                participant_wins += 1
+            elif "team" in d and d["team"] == "site":
+                site_wins += 1
+    return 1 if participant_wins > site_wins else -1 \
+        if participant_wins < site_wins else 0
+
+
+def _count_outcomes_python(userid, site_ids, qtypes, qid, test_periods):
+    # Reference implementation of _count_outcomes_pipeline
+    counts = {}
+    for site_id in site_ids:
+        for qtype in qtypes:
+            feedbacks = get_test_feedback(userid=userid, site_id=site_id,
+                                          qtype=qtype, qid=qid)
+            for f in feedbacks:
+                outcome = _get_outcome(f)
+                if qtype == "test":
+                    keys = [(site_id, qtype, i)
+                            for i, test_period in test_periods
+                            if test_period["START"] < f["creation_time"] <
+                            test_period["END"]]
+                else:
+                    keys = [(site_id, qtype, None)]
+                for key in keys:
+                    wins, losses, ties = counts.get(key, (0, 0, 0))
+                    counts[key] = (wins + (outcome > 0),
+                                   losses + (outcome < 0),
+                                   ties + (outcome == 0))
+    return counts
+
+
+def _count_outcomes_pipeline(userid, site_ids, qtypes, qid, test_periods):
+    # Counts wins, losses and ties per site, query type and test period in a
+    # single aggregation over the feedback collection.
+    def clicks(team):
+        clicked = {"$cond": [{"$isArray": "$$d.clicked"},
+                             {"$gt": [{"$size": "$$d.clicked"}, 0]},
+                             {"$eq": ["$$d.clicked", True]}]}
+        return {"$size": {"$filter": {
+            "input": "$doclist",
+            "as": "d",
+            "cond": {"$and": [{"$eq": ["$$d.team", team]}, clicked]}}}}
+
+    def count(outcome, in_period=None):
+        cond = {"$eq": ["$outcome", outcome]}
+        if in_period is not None:
+            cond = {"$and": [cond, in_period]}
+        return {"$sum": {"$cond": [cond, 1, 0]}}
+
+    match = {"doclist": {"$exists": True},
+             "site_id": {"$in": site_ids},
+             "qtype": {"$in": qtypes}}
+    if userid:
+        match["userid"] = userid
+    deleted = _get_deleted_qids(site_ids)
+    if qid and qid.lower() != "all":
+        if qid in deleted:
+            return {}
+        match["qid"] = qid
+    elif deleted:
+        match["qid"] = {"$nin": deleted}
+
+    group = {"_id": {"site_id": "$site_id", "qtype": "$qtype"},
+             "wins": count(1), "losses": count(-1), "ties": count(0)}
+    for i, test_period in test_periods:
+        in_period = {"$and": [
+            {"$gt": ["$creation_time", test_period["START"]]},
+            {"$lt": ["$creation_time", test_period["END"]]}]}
+        group["wins_%d" % i] = count(1, in_period)
+        group["losses_%d" % i] = count(-1, in_period)
+        group["ties_%d" % i] = count(0, in_period)
+
+    pipeline = [
+        {"$match": match},
+        {"$project": {
+            "site_id": True,
+            "creation_time": True,
+            "qtype": True,
+            "participant": clicks("participant"),
+            "site": clicks("site")}},
+        {"$project": {
+            "site_id": True,
+            "creation_time": True,
+            "qtype": True,
+            "outcome": {"$cmp": ["$participant", "$site"]}}},
+        {"$group": group},
+    ]
+
+    counts = {}
+    for g in db.feedback.aggregate(pipeline):
+        site_id = g["_id"]["site_id"]
+        qtype = g["_id"]["qtype"]
         if qtype == "test":
-            qtype_qids = set([q["_id"] for q in query.get_query(site_id=site_id)
-                              if "type" in q and q["type"] == "test"])
-        else:
-            qtype_qids = set([q["_id"] for q in query.get_query(site_id=site_id)
-                              if ("type" in q and q["type"] != "test") or "type" not in q])
-
-    readyfeedback = []
-    for f in feedbacks:
-        if qtype is not None:
-            if f["qid"] in qtype_qids:
-                readyfeedback.append(f)
+            for i, test_period in test_periods:
+                counts[(site_id, qtype, i)] = (g["wins_%d" % i],
+                                               g["losses_%d" % i],
+                                               g["ties_%d" % i])
         else:
-            readyfeedback.append(f)
-    return readyfeedback
-
-
-def get_comparison(userid=None, site_id=None, qtype=None, qid=None):
-    def get_outcome(feedback):
-        participant_wins = 0
-        site_wins = 0
-        for d in feedback["doclist"]:
-            if "clicked" in d and (d["clicked"] is True or
-                                   (isinstance(d["clicked"], list) and
-                                    len(d["clicked"]) > 0)):
-                if "team" in d and d["team"] == "participant":
-                    participant_wins += 1
-                elif "team" in d and d["team"] == "site":
-                    site_wins += 1
-        return 1 if participant_wins > site_wins else -1 \
-            if participant_wins < site_wins else 0
-
-    def get_outcomes(feedbacks, outcomes, test_period=None,
-                     return_outcome=False):
-        if test_period and datetime.datetime.now() < test_period["END"]:
-            return
-
-        nr_wins = 0
-        nr_losses = 0
-        nr_ties = 0
-        for f in feedbacks:
-            if test_period and not (test_period["START"] <
-                                    f["creation_time"] <
-                                    test_period["END"]):
-                continue
-
-            outcome = get_outcome(f)
-            if outcome > 0:
-                nr_wins += 1
-            elif outcome < 0:
-                nr_losses += 1
-            else:
-                nr_ties += 1
-
-        agg_outcome = float(nr_wins) / (nr_wins + nr_losses) if nr_wins + nr_losses > 0 else 0
-        impressions = nr_wins + nr_losses + nr_ties
-        if impressions > 0 or return_outcome:
-            outcome_struct = {"qid": qid,
-                              "type": qtype,
-                              "site_id": site_id,
-                              "outcome": agg_outcome,
-                              "wins": nr_wins,
-                              "losses": nr_losses,
-                              "ties": nr_ties,
-                              "impressions": impressions}
-            if test_period:
-                outcome_struct["test_period"] = test_period
-            outcomes.append(outcome_struct)
-
+            counts[(site_id, qtype, None)] = (g["wins"], g["losses"],
+                                              g["ties"])
+    return counts
+
+
+def get_comparison(userid=None, site_id=None, qtype=None, qid=None,
+                   pipeline=True):
+    """
+    Returns the wins, losses and ties of a participant against the site, per
+    site and query type, and for test queries per finished test period.
+    Outcomes are counted by an aggregation pipeline; with pipeline=False, or
+    if the server does not support it, they are computed in Python.
+    """
     if site_id is not None:
         site_ids = [site_id]
     else:
@@ -274,23 +488,221 @@ def get_comparison(userid=None, site_id=None, qtype=None, qid=None):
     if qid is None:
         qid = "all"
 
+    test_periods = _finished_test_periods()
+
+    counts = None
+    if pipeline:
+        try:
+            counts = _count_outcomes_pipeline(userid, site_ids, qtypes, qid,
+                                              test_periods)
+        except OperationFailure:
+            counts = None
+    if counts is None:
+        counts = _count_outcomes_python(userid, site_ids, qtypes, qid,
+                                        test_periods)
+
+    return _get_outcome_list(counts, site_ids, qtypes, qid, test_periods,
+                             return_outcome)
+
+
+def _finished_test_periods():
+    # Test periods that are still running are not reported
+    now = datetime.datetime.now()
+    return [(i, test_period)
+            for i, test_period in enumerate(config["TEST_PERIODS"])
+            if now >= test_period["END"]]
+
+
+def _get_outcome_list(counts, site_ids, qtypes, qid, test_periods,
+                      return_outcome):
     outcomes = []
     for site_id in site_ids:
         for qtype in qtypes:
-            feedbacks = get_test_feedback(userid=userid, site_id=site_id,
-                                          qtype=qtype, qid=qid)
             if qtype == "test":
-                for test_period in config["TEST_PERIODS"]:
-                    get_outcomes(feedbacks, outcomes,
-                                 test_period=test_period,
-                                 return_outcome=return_outcome)
+                keys = test_periods
             else:
-                get_outcomes(feedbacks, outcomes,
-                             return_outcome=return_outcome)
+                keys = [(None, None)]
+            for i, test_period in keys:
+                nr_wins, nr_losses, nr_ties = counts.get((site_id, qtype, i),
+                                                         (0, 0, 0))
+                agg_outcome = float(nr_wins) / (nr_wins + nr_losses) \
+                    if nr_wins + nr_losses > 0 else 0
+                impressions = nr_wins + nr_losses + nr_ties
+                if impressions == 0 and not return_outcome:
+                    continue
+                outcome_struct = {"qid": qid,
+                                  "type": qtype,
+                                  "site_id": site_id,
+                                  "outcome": agg_outcome,
+                                  "wins": nr_wins,
+                                  "losses": nr_losses,
+                                  "ties": nr_ties,
+                                  "impressions": impressions}
+                if test_period:
+                    outcome_struct["test_period"] = test_period
+                outcomes.append(outcome_struct)
     return outcomes
 
 
-def get_historical_feedback(site_id=None, qid=None, site_qid=None):
+# The outcome collection holds the wins, losses, ties and impressions of each
+# participant per site, query (and "all" queries), query type and test period.
+# add_feedback, reset_feedback and delete_query keep it up to date, so the
+# outcome endpoint only has to read the rows of one participant and query.
+
+_OUTCOME_FIELDS = {1: "wins", -1: "losses", 0: "ties"}
+
+
+def _outcome_id(row):
+    return "%s/%s/%s/%s/%s" % (row["userid"], row["site_id"], row["qid"],
+                               row["type"], row["test_period"] or "")
+
+
+def _outcome_rows(session, qtype):
+    # Training sessions count for all time, test sessions for every test
+    # period they fall in
+    if qtype == "test":
+        test_periods = [test_period["NAME"]
+                        for test_period in config["TEST_PERIODS"]
+                        if test_period["START"] < session["creation_time"] <
+                        test_period["END"]]
+    else:
+        test_periods = [None]
+    return [{"userid": session["userid"],
+             "site_id": session["site_id"],
+             "qid": qid,
+             "type": qtype,
+             "test_period": test_period}
+            for qid in [session["qid"], "all"]
+            for test_period in test_periods]
+
+
+def _update_outcome(session, old_outcome, new_outcome):
+    if old_outcome == new_outcome:
+        return
+    if db.query.find_one({"_id": session["qid"], "deleted": True},
+                         {"_id": True}):
+        return
+    qtype = session.get("qtype") or \
+        get_qtype(db.query.find_one({"_id": session["qid"]}, {"type": True}))
+    inc = {_OUTCOME_FIELDS[new_outcome]: 1}
+    if old_outcome is None:
+        inc["impressions"] = 1
+    else:
+        inc[_OUTCOME_FIELDS[old_outcome]] = -1
+    requests = [UpdateOne({"_id": _outcome_id(row)},
+                          {"$set": row, "$inc": inc}, upsert=True)
+                for row in _outcome_rows(session, qtype)]
+    if requests:
+        db.outcome.bulk_write(requests, ordered=False)
+
+
+def _remove_outcomes(sessions):
+    # Subtracts removed sessions from the rows add_feedback counted them in
+    queries = dict((q["_id"], q) for q in db.query.find(
+        {"_id": {"$in": list(set(f["qid"] for f in sessions))}},
+        {"type": True, "deleted": True}))
+    incs = {}
+    for f in sessions:
+        query = queries.get(f["qid"])
+        if query and query.get("deleted"):
+            continue
+        qtype = f.get("qtype") or get_qtype(query)
+        field = _OUTCOME_FIELDS[_get_outcome(f)]
+        for row in _outcome_rows(f, qtype):
+            inc = incs.setdefault(_outcome_id(row), {"impressions": 0})
+            inc[field] = inc.get(field, 0) - 1
+            inc["impressions"] -= 1
+    requests = [UpdateOne({"_id": outcome_id}, {"$inc": inc})
+                for outcome_id, inc in incs.items()]
+    for i in range(0, len(requests), 1000):
+        db.outcome.bulk_write(requests[i:i + 1000], ordered=False)
+
+
+def remove_query_outcomes(qid):
+    """
+    Removes the outcome rows of a deleted query and subtracts them from the
+    rows of all queries.
+    """
+    for outcome_id in db.outcome.distinct("_id", {"qid": qid}):
+        row = db.outcome.find_one_and_delete({"_id": outcome_id})
+        if row is None:
+            continue
+        row["qid"] = "all"
+        db.outcome.update_one(
+            {"_id": _outcome_id(row)},
+            {"$inc": dict((field, -row.get(field, 0))
+                          for field in ["wins", "losses", "ties",
+                                        "impressions"])})
+
+
+def rebuild_outcomes():
+    """
+    Recomputes the outcome collection from all feedback. Feedback that
+    add_feedback stores while this runs may be missing from the rows it
+    replaces until the next rebuild. Returns the number of sessions read.
+    """
+    deleted = set(_get_deleted_qids())
+    qtypes = dict((q["_id"], get_qtype(q))
+                  for q in db.query.find({}, {"type": True}))
+    rows = {}
+    n = 0
+    for f in db.feedback.find({"doclist": {"$exists": True}},
+                              {"userid": True, "site_id": True, "qid": True,
+                               "qtype": True, "creation_time": True,
+                               "doclist": True}):
+        n += 1
+        if f["qid"] in deleted:
+            continue
+        qtype = f.get("qtype") or qtypes.get(f["qid"], "train")
+        field = _OUTCOME_FIELDS[_get_outcome(f)]
+        for row in _outcome_rows(f, qtype):
+            row = rows.setdefault(_outcome_id(row),
+                                  dict(row, wins=0, losses=0, ties=0,
+                                       impressions=0))
+            row[field] += 1
+            row["impressions"] += 1
+
+    rebuilt = datetime.datetime.now()
+    requests = [ReplaceOne({"_id": outcome_id}, dict(row, rebuilt=rebuilt),
+                           upsert=True)
+                for outcome_id, row in rows.items()]
+    for i in range(0, len(requests), 1000):
+        db.outcome.bulk_write(requests[i:i + 1000], ordered=False)
+    db.outcome.delete_many({"rebuilt": {"$lt": rebuilt}})
+    return n
+
+
+def get_outcomes(userid, qid=None):
+    """
+    Returns the same outcomes as get_comparison(userid, qid=qid), read from
+    the outcome collection.
+    """
+    site_ids = user.get_sites(userid)
+    if not site_ids:
+        raise Exception("First signup for sites.")
+    if qid is None or qid.lower() == "all":
+        qid = "all"
+    test_periods = _finished_test_periods()
+    period_index = dict((test_period["NAME"], i)
+                        for i, test_period in test_periods)
+    counts = {}
+    for row in db.outcome.find({"userid": userid, "qid": qid}):
+        if row["test_period"] is None:
+            i = None
+        elif row["test_period"] in period_index:
+            i = period_index[row["test_period"]]
+        else:
+            continue
+        # Rows that add_feedback created only hold the fields it counted
+        counts[(row["site_id"], row["type"], i)] = (row.get("wins", 0),
+                                                    row.get("losses", 0),
+                                                    row.get("ties", 0))
+    return _get_outcome_list(counts, site_ids, ["test", "train"], qid,
+                             test_periods, False)
+
+
+def get_historical_feedback(site_id=None, qid=None, site_qid=None,
+                            secondary=False):
     q = {}
     if site_id:
         q["site_id"] = site_id
@@ -298,4 +710,5 @@ def get_historical_feedback(site_id=None, qid=None, site_qid=None):
         q["site_qid"] = site_qid
     if qid and qid.lower() != "all":
         q["qid"] = qid
-    return db.historical.find(q)
+    historical = db.secondary.historical if secondary else db.historical
+    return historical.find(q)
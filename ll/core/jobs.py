@@ -0,0 +1,274 @@
+# This file is part of Living Labs Challenge, see http://living-labs.net.
+#
+# Living Labs Challenge is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Living Labs Challenge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Living Labs Challenge. If not, see <http://www.gnu.org/licenses/>.
+
+# Periodic maintenance jobs, run by bin/worker. Several workers can run at
+# the same time; only the one holding the worker lease runs the jobs. A
+# lease is a document in the lease collection that its owner renews before
+# it expires, after which another worker can take it over.
+
+import time
+import logging
+import datetime
+import threading
+from collections import defaultdict
+from pymongo.errors import DuplicateKeyError
+from db import db
+from config import config
+import user, site, query, run, feedback, stats, metrics
+
+log = logging.getLogger(__name__)
+WORKER_LEASE = "worker"
+
+
+def acquire_lease(name, owner, seconds):
+    """
+    Takes or renews lease name for owner, for the given number of seconds.
+    Returns whether owner holds the lease.
+    """
+    now = datetime.datetime.utcnow()
+    try:
+        db.lease.update_one({"_id": name,
+                             "$or": [{"owner": owner},
+                                     {"expires": {"$lt": now}}]},
+                            {"$set": {"owner": owner,
+                                      "expires": now + datetime.timedelta(
+                                          seconds=seconds)}},
+                            upsert=True)
+    except DuplicateKeyError:
+        # Someone else holds the lease, so the upsert clashed on _id
+        return False
+    return True
+
+
+def release_lease(name, owner):
+    db.lease.delete_one({"_id": name, "owner": owner})
+
+
+def _renew_lease(name, owner, seconds, done):
+    while not done.wait(seconds / 3.0):
+        if not acquire_lease(name, owner, seconds):
+            log.warning("%s lost lease %s", owner, name)
+
+
+def run_job(name, job, owner):
+    """
+    Runs job if owner holds the worker lease, and stores when it ran, how
+    long it took and how many documents it read in the job collection and
+    in metrics. The lease is renewed while the job runs. Returns that
+    report, or None if another worker holds the lease.
+    """
+    seconds = config["WORKER_LEASE_SECONDS"]
+    if not acquire_lease(WORKER_LEASE, owner, seconds):
+        return None
+    done = threading.Event()
+    heartbeat = threading.Thread(target=_renew_lease,
+                                 args=(WORKER_LEASE, owner, seconds, done))
+    heartbeat.daemon = True
+    heartbeat.start()
+    started = datetime.datetime.now()
+    start = time.time()
+    try:
+        rows = job()
+    finally:
+        done.set()
+        heartbeat.join()
+    report = {"_id": name,
+              "owner": owner,
+              "started": started,
+              "duration": time.time() - start,
+              "rows": rows}
+    db.job.replace_one({"_id": name}, report, upsert=True)
+    metrics.timing("job.%s.seconds" % name, report["duration"])
+    metrics.incr("job.%s.rows" % name, rows)
+    return report
+
+
+def db_cleanup():
+    """
+    Deactivates runs past their reactivation period and notifies
+    participants of outdated runs, with one digest email per participant.
+    Returns the number of runs it looked at.
+    """
+    log.info("Database cleanup task started")
+
+    # First delete runs, then notify outdated. Because there is overlap:
+    # deletable runs is a subset of outdated runs
+    deletable_runs_age, deletable_runs_doclist = run.get_deletable_runs()
+    run.deactivate_runs(deletable_runs_age + deletable_runs_doclist)
+    outdated_runs_age, outdated_runs_doclist = run.get_outdated_runs()
+
+    digests = defaultdict(list)
+    if config["SEND_EMAIL_RUN_DELETED"]:
+        for r in deletable_runs_age:
+            digests[r["userid"]].append(
+                "Your outdated run " + r["runid"] + " for query " + r["qid"] + " is past the reactivation period and has been deleted.")
+        for r in deletable_runs_doclist:
+            digests[r["userid"]].append(
+                "Your run " + r["runid"] + " for query " + r["qid"] + " is past the reactivation period (document list obsolete) and has been deleted.")
+
+    notified = []
+    outdated_users = set()
+    if config["SEND_EMAIL_RUN_OUTDATED"]:
+        for runs, reason in [(outdated_runs_age, "is older than the set age threshold of " + str(config["RUN_AGE_THRESHOLD_DAYS"]) + " days"),
+                             (outdated_runs_doclist, "is older than the corresponding document list")]:
+            for r in runs:
+                # Only send outdated notification if no new notification has been sent
+                if "notification_sent_time" not in r or r["notification_sent_time"] < r["creation_time"]:
+                    digests[r["userid"]].append(
+                        "Your run " + r["runid"] + " for query " + r["qid"] + " " + reason + ".")
+                    notified.append(r["_id"])
+                    outdated_users.add(r["userid"])
+
+    emails = []
+    for userid, lines in sorted(digests.items()):
+        try:
+            run_user = user.get_user(userid)
+        except Exception:
+            # The participant was deleted, there is nobody to tell
+            continue
+        txt = "\n".join(lines)
+        if userid in outdated_users:
+            txt += "\n\nOutdated runs will be deleted in " + str(config["REACTIVATION_PERIOD_DAYS"]) + " days. If a run is valuable, you can reactivate it via " + str(config["URL_REACTIVATION"]) + " inside the reactivation period. After " + str(config["REACTIVATION_PERIOD_DAYS"]) + " days, it is not possible to reactivate anymore."
+        emails.append((run_user, txt, "Outdated and deleted runs"))
+    if user.send_emails(emails):
+        metrics.incr("cleanup.emails_sent", len(emails))
+
+    if notified:
+        # Add time of notification to the runs, so no new notification is
+        # sent immediately
+        db.run.update_many({"_id": {"$in": notified}},
+                           {"$set": {"notification_sent_time":
+                                     datetime.datetime.now()}})
+
+    return (len(deletable_runs_age) + len(deletable_runs_doclist) +
+            len(outdated_runs_age) + len(outdated_runs_doclist))
+
+
+def calculate_statistics():
+    """
+    Reconciles the dashboard counters and the outcome table, and stores the
+    admin statistics. Returns the number of documents it read.
+    """
+    log.info("Calculate statistics")
+    sessions = 0
+
+    # Reconcile the dashboard counters, which are otherwise maintained
+    # incrementally by stats
+    stats.flush_stats()
+    participants = user.get_participants()
+    new_stats = lambda: {"run": 0, "impression": 0, "click": 0}
+    participant_stats = defaultdict(new_stats)
+    participant_site_stats = defaultdict(new_stats)
+    for participant in participants:
+        participant_id = participant["_id"]
+        participant_stats[participant_id] = new_stats()
+        for site_id in user.get_sites(participant_id):
+            participant_site_stats[(participant_id, site_id)] = new_stats()
+
+    site_stats = {}
+    for s in site.get_sites():
+        site_id = s["_id"]
+        site_stats[site_id] = {
+            "query": db.query.find({"site_id": site_id}).count(),
+            "doc": db.doc.find({"site_id": site_id}).count(),
+            "impression": 0,
+            "click": 0,
+        }
+        # A single pass over the sessions of a site counts the impressions
+        # and clicks for all participants at once
+        for f in db.feedback.find({"site_id": site_id},
+                                  {"userid": True, "doclist": True}):
+            sessions += 1
+            participant_id = f["userid"]
+            clicks = stats.get_clicks(f.get("doclist", []))
+            for counts in [site_stats[site_id],
+                           participant_stats[participant_id],
+                           participant_site_stats[(participant_id, site_id)]]:
+                counts["impression"] += 1
+                counts["click"] += clicks
+
+    runs = 0
+    for group in db.run.aggregate([
+            {"$group": {"_id": {"userid": "$userid", "site_id": "$site_id"},
+                        "n": {"$sum": 1}}}]):
+        runs += group["n"]
+        participant_id = group["_id"]["userid"]
+        site_id = group["_id"]["site_id"]
+        participant_stats[participant_id]["run"] += group["n"]
+        participant_site_stats[(participant_id, site_id)]["run"] = group["n"]
+
+    for site_id, counts in site_stats.items():
+        stats.set_stats(stats.site_stats_id(site_id), counts)
+    for participant_id, counts in participant_stats.items():
+        stats.set_stats(stats.participant_stats_id(participant_id), counts)
+    for (participant_id, site_id), counts in participant_site_stats.items():
+        stats.set_stats(
+            stats.participant_site_stats_id(participant_id, site_id),
+            counts)
+
+    # Reconcile the outcome table, which add_feedback updates incrementally
+    with metrics.timed("statistics.outcomes.seconds"):
+        outcome_sessions = feedback.rebuild_outcomes()
+
+    # Calculate admin statistics
+    queries = query.get_query()
+    sites = [s for s in site.get_sites()]
+    active_participants = set()
+    site_participants = {}
+    site_queries = {}
+
+    qtypes = {}
+    for q in queries:
+        if not q["site_id"] in site_queries:
+            site_queries[q["site_id"]] = [0, 0]
+        if "type" in q and q["type"] == "test":
+            site_queries[q["site_id"]][1] += 1
+        else:
+            site_queries[q["site_id"]][0] += 1
+        qtypes[q["_id"]] = q.get("type")
+
+    for active_run in run.get_active_runs():
+        if active_run["qid"] not in qtypes:
+            # The query was deleted
+            continue
+        u = active_run["userid"]
+        if not active_run["site_id"] in site_participants:
+            site_participants[active_run["site_id"]] = [set(), set()]
+        active_participants.add(u)
+        if qtypes[active_run["qid"]] == "test":
+            site_participants[active_run["site_id"]][1].add(u)
+        else:
+            site_participants[active_run["site_id"]][0].add(u)
+
+    stats_admin = {"participants": {"verified":  len([u for u in participants
+                                                        if u["is_verified"]]),
+                                      "all":  len(participants),
+                                      "active":  len(active_participants)
+                                      },
+                     "sites": {"runs": len(site_participants),
+                               "all": len(sites),
+                               "active": len([s for s in sites if s["enabled"]])},
+                     "queries": len(queries),
+                     "per_site": {s["_id"]: {"participants": {"train": len(site_participants[s["_id"]][0]), "test":len(site_participants[s["_id"]][1])} if s["_id"] in site_participants else {"train":0, "test":0},
+                                             "queries": {"train": site_queries[s["_id"]][0], "test":site_queries[s["_id"]][1]} if s["_id"] in site_queries else {"train":0, "test":0}
+                                            } for s in sites
+                                  }
+                     }
+    stats.set_admin(stats_admin)
+
+    metrics.incr("statistics.sessions_scanned", sessions + outcome_sessions)
+    metrics.incr("statistics.runs_counted", runs)
+    metrics.incr("statistics.queries_scanned", len(queries))
+    return sessions + runs + outcome_sessions + len(queries)
@@ -0,0 +1,55 @@
+# This file is part of Living Labs Challenge, see http://living-labs.net.
+#
+# Living Labs Challenge is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Living Labs Challenge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Living Labs Challenge. If not, see <http://www.gnu.org/licenses/>.
+
+# Counters and timings of the background jobs, such as cleanup.runs_deleted
+# or job.statistics.seconds. They are handed to a sink, a function of
+# (kind, name, value) with kind "counter" or "timing". The default sink
+# logs them; set_sink plugs in another one, e.g. one that sends them to
+# statsd.
+
+import time
+import logging
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+
+def log_sink(kind, name, value):
+    log.info("%s %s %s", kind, name, value)
+
+
+_sink = log_sink
+
+
+def set_sink(sink):
+    global _sink
+    _sink = sink if sink is not None else log_sink
+
+
+def incr(name, n=1):
+    _sink("counter", name, n)
+
+
+def timing(name, seconds):
+    _sink("timing", name, seconds)
+
+
+@contextmanager
+def timed(name):
+    start = time.time()
+    try:
+        yield
+    finally:
+        timing(name, time.time() - start)
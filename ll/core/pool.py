@@ -0,0 +1,74 @@
+# This file is part of Living Labs Challenge, see http://living-labs.net.
+#
+# Living Labs Challenge is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Living Labs Challenge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Living Labs Challenge. If not, see <http://www.gnu.org/licenses/>.
+
+# Per-process pool of the active runs for each (site_id, site_qid), so that
+# serving a ranking does not have to go to the database. Each entry carries
+# the scheduler heap used to pick the least-served run. Entries are dropped
+# when the runs of a query change in this process, and expire after
+# RANKING_POOL_SECONDS to pick up changes made by other processes.
+
+import time
+import threading
+from db import db
+from config import config
+import scheduler
+
+_entries = {}
+_lock = threading.Lock()
+
+
+def _load(site_id, site_qid):
+    query = db.query.find_one({"site_id": site_id, "site_qid": site_qid})
+    if query is None:
+        raise LookupError("Query not found: site_qid = '%s'. Only rankings "
+                          "for existing queries can be expected." % site_qid)
+    pointers = [{"runid": active_run["runid"],
+                 "qid": query["_id"],
+                 "userid": active_run["userid"]}
+                for active_run in db.active_run.find({"qid": query["_id"]})]
+    runs = {}
+    if pointers:
+        for run in db.run.find({"$or": pointers}):
+            if run["doclist"] and run["userid"] not in runs:
+                runs[run["userid"]] = run
+    return {"qid": query["_id"],
+            "type": query.get("type"),
+            "runs": runs,
+            "heap": scheduler.schedule(query["_id"], runs.keys()),
+            "expires": time.time() + config["RANKING_POOL_SECONDS"]}
+
+
+def get(site_id, site_qid):
+    key = (site_id, site_qid)
+    with _lock:
+        entry = _entries.get(key)
+    if entry is None or entry["expires"] < time.time():
+        entry = _load(site_id, site_qid)
+        with _lock:
+            _entries[key] = entry
+    if not entry["runs"]:
+        raise LookupError("No rankings available for query: site_qid = '%s'. "
+                          "Participants will have to submit runs first. "
+                          "Sites should be able to handle such errors."
+                          % site_qid)
+    return entry
+
+
+def invalidate(site_id=None, site_qid=None):
+    with _lock:
+        if site_id is None and site_qid is None:
+            _entries.clear()
+        else:
+            _entries.pop((site_id, site_qid), None)
@@ -18,6 +18,9 @@ import string
 import datetime
 import site
 import user
+import pool
+import feedback
+import stats
 from db import db
 
 
@@ -27,6 +30,9 @@ def add_query(site_id, site_qid, qstr, query_type, qid=None):
         raise Exception("qid's should start with the site_id, i.e., %s-q100. "
                         "This qid violates that rule: %s" % (site_id, qid))
     if query:
+        if query.get("type") != query_type:
+            # Sessions carry the type of their query
+            feedback.set_qtype(query["_id"], query_type)
         query["qstr"] = qstr
         query["type"] = query_type
         query["creation_time"] = datetime.datetime.now()
@@ -47,6 +53,8 @@ def add_query(site_id, site_qid, qstr, query_type, qid=None):
         if qid is not None:
             query["_id"] = qid
         db.query.insert(query)
+        stats.count_queries(site_id)
+    pool.invalidate(site_id, site_qid)
     return query
 
 
@@ -64,7 +72,37 @@ def get_query(site_id=None, qid=None, key=None):
     if qid is not None:
         q["_id"] = qid
 
-    return [query for query in db.query.find(q)]
+    # Participants can do with a slightly stale copy
+    queries = db.secondary.query if key is not None else db.query
+    return [query for query in queries.find(q)]
+
+
+def get_query_version(key):
+    """
+    Returns the state and last modification time of the queries with a
+    doclist on the sites a participant signed up for, without reading the
+    queries themselves. Besides their number and creation times, the state
+    covers when a doclist was last changed and a query last deleted, so a
+    query that replaces another one changes it too.
+    """
+    sites = sorted(user.get_sites(key))
+    if not sites:
+        raise Exception("First signup for sites.")
+    visible = {"$and": [{"$ne": ["$deleted", True]},
+                        {"$gt": ["$doclist", None]}]}
+    state = (0, None, None, None)
+    for g in db.secondary.query.aggregate([
+            {"$match": {"site_id": {"$in": sites}}},
+            {"$group": {"_id": None,
+                        "n": {"$sum": {"$cond": [visible, 1, 0]}},
+                        "created": {"$max": {"$cond": [visible,
+                                                       "$creation_time",
+                                                       None]}},
+                        "doclist_modified": {"$max": "$doclist_modified_time"},
+                        "deleted": {"$max": "$deleted_time"}}}]):
+        state = (g["n"], g["created"], g["doclist_modified"], g["deleted"])
+    modified = [t for t in state[1:] if t is not None]
+    return (sites,) + state, max(modified) if modified else None
 
 
 def delete_query(site_id=None, qid=None):
@@ -78,6 +116,8 @@ def delete_query(site_id=None, qid=None):
 
     if existing_query:
         existing_query["deleted"] = True
+        existing_query["deleted_time"] = datetime.datetime.now()
         db.query.save(existing_query)
+        feedback.remove_query_outcomes(existing_query["_id"])
         return True
     return False
@@ -18,69 +18,103 @@ from db import db
 from config import config
 import random
 import pymongo
+from pymongo.errors import DuplicateKeyError, BulkWriteError
 import datetime
+import logging
+from collections import Counter
 import site
 import user
 import query
 import feedback
+import doc
+import pool
+import scheduler
+import stats
+import metrics
+
+log = logging.getLogger(__name__)
+
+# The current run of each participant for a query is pointed to by a
+# document in the active_run collection, keyed by qid and userid. The runs
+# themselves stay in the run collection, also when they are replaced.
+
+
+def _active_run_id(qid, userid):
+    return "%s/%s" % (qid, userid)
+
+
+def _set_active_run(run, only_new=False):
+    """
+    Points the active run of the participant for the query of run to it.
+    With only_new, raises DuplicateKeyError if there already was one.
+    """
+    active_run = _active_run(run)
+    active_run_id = _active_run_id(run["qid"], run["userid"])
+    if only_new:
+        active_run["_id"] = active_run_id
+        db.active_run.insert_one(active_run)
+    else:
+        db.active_run.update_one({"_id": active_run_id},
+                                 {"$set": active_run}, upsert=True)
+
+
+def _active_run(run):
+    return {"qid": run["qid"],
+            "userid": run["userid"],
+            "site_id": run["site_id"],
+            "site_qid": run["site_qid"],
+            "runid": run["runid"],
+            "creation_time": run["creation_time"]}
+
+
+def get_active_run(key, qid):
+    return db.active_run.find_one({"_id": _active_run_id(qid, key)})
+
+
+def get_active_runs(qid=None, key=None):
+    q = {}
+    if qid is not None:
+        q["qid"] = qid
+    if key is not None:
+        q["userid"] = key
+    return db.active_run.find(q)
+
 
 def get_ranking(site_id, site_qid):
-    query = db.query.find_one({"site_id": site_id, "site_qid": site_qid})
-    if query is None:
-        raise LookupError("Query not found: site_qid = '%s'. Only rankings "
-                          "for existing queries can be expected." % site_qid)
-    if "runs" not in query or not query["runs"]:
-        raise LookupError("No rankings available for query: site_qid = '%s'. "
-                          "Participants will have to submit runs first. "
-                          "Sites should be able to handle such errors."
-                          % site_qid)
-    allruns = query["runs"].items()
-    random.shuffle(allruns)
-    for userid, runid_pair in allruns:
-        # Check if runid is paired with a timestamp (new format)
-        if isinstance(runid_pair, list):
-            runid, run_modified_time = runid_pair
-        else:
-            # Not paired with timestamp, only runid present (old format)
-            runid = runid_pair
-        runs = db.run.find({"runid": runid,
-                            "site_qid": site_qid,
-                            "userid": userid
-                            }).hint([("runid", pymongo.ASCENDING),
-                                     ("site_qid", pymongo.ASCENDING),
-                                     ("userid", pymongo.ASCENDING)
-                                     ])
-        run = runs[0]
-        if len(run["doclist"]) > 0:
-            break
+    entry = pool.get(site_id, site_qid)
+    userid = scheduler.next(entry["qid"], entry["heap"])
+    run = dict(entry["runs"][userid])
     sid = site.next_sid(site_id)
-    feedback = {
+    session = {
         "_id": sid,
         "site_qid": site_qid,
         "site_id": site_id,
-        "qid": query["_id"],
+        "qid": entry["qid"],
+        "qtype": "test" if entry["type"] == "test" else "train",
         "runid": run["runid"],
         "userid": run["userid"],
         "creation_time": datetime.datetime.now(),
     }
-    db.feedback.save(feedback)
+    feedback.add_session(session)
+    stats.count_impressions(run["userid"], site_id)
     run["sid"] = sid
     return run
 
 
+def _in_test_period():
+    for test_period in config["TEST_PERIODS"]:
+        if test_period["START"] < datetime.datetime.now() < test_period["END"]:
+            return True
+    return False
+
+
 def add_run(key, qid, runid, doclist):
     q = db.query.find_one({"_id": qid})
     if not q:
         raise LookupError("Query does not exist: qid = '%s'" % qid)
 
-    in_test_period = False
-    for test_period in config["TEST_PERIODS"]:
-        if test_period["START"] < datetime.datetime.now() < test_period["END"]:
-            in_test_period = True
-            break
-
-    if in_test_period and "type" in q and q["type"] == "test" \
-            and "runs" in q and key in q["runs"]:
+    only_once = _in_test_period() and "type" in q and q["type"] == "test"
+    if only_once and get_active_run(key, qid):
         raise ValueError("For test queries you can only upload a run once "
                          "during a test period.")
     sites = user.get_sites(key)
@@ -88,12 +122,13 @@ def add_run(key, qid, runid, doclist):
         raise LookupError("First sign up for site %s." % q["site_id"])
     if len(doclist) == 0:
         raise ValueError("The doclist should contain documents.")
-    for doc in doclist:
-        doc_found = db.doc.find_one({"_id": doc["docid"]})
-        if not doc_found:
+    site_docids = doc.resolve_docids(q["site_id"],
+                                     [d["docid"] for d in doclist])
+    for d in doclist:
+        if d["docid"] not in site_docids:
             raise LookupError("Document not found: docid = '%s'. Only submit "
-                              "runs with existing documents." % doc["docid"])
-        doc["site_docid"] = doc_found["site_docid"]
+                              "runs with existing documents." % d["docid"])
+        d["site_docid"] = site_docids[d["docid"]]
 
     creation_time = datetime.datetime.now()
     run = {
@@ -105,30 +140,248 @@ def add_run(key, qid, runid, doclist):
         "doclist": doclist,
         "creation_time": creation_time,
     }
-    db.run.remove({"runid": runid,
-                   "qid": qid,
-                   "userid": key})
-    db.run.save(run)
-    if "runs" in q:
-        runs = q["runs"]
-    else:
-        runs = {}
-    runs[key] = (runid, creation_time)
-
-    q["runs"] = runs
-    db.query.save(q)
+    if only_once:
+        # Claim the active run before storing the run, so an upload that a
+        # concurrent one beat does not replace the run the latter points to.
+        # Until the run is stored, the ranking pool skips the pointer, or
+        # finds an earlier upload with the same runid.
+        try:
+            _set_active_run(run, only_new=True)
+        except DuplicateKeyError:
+            raise ValueError("For test queries you can only upload a run "
+                             "once during a test period.")
+    try:
+        result = _replace_run(run)
+    except Exception:
+        if only_once:
+            db.active_run.delete_one({"_id": _active_run_id(qid, key),
+                                      "creation_time": creation_time})
+        raise
+    if not only_once:
+        # Store the run before pointing to it, so the ranking pool never
+        # finds a pointer to a run that is not there
+        _set_active_run(run)
+    if result.upserted_id is not None:
+        stats.count_runs(key, q["site_id"])
+    pool.invalidate(q["site_id"], q["site_qid"])
     return run
 
 
-def get_run(key, qid):
-    q = db.query.find_one({"_id": qid})
-    if not q:
-        raise LookupError("Query does not exist: qid = '%s'" % qid)
+def _replace_run(run):
+    run_key = {"runid": run["runid"], "qid": run["qid"],
+               "userid": run["userid"]}
+    try:
+        return db.run.replace_one(run_key, run, upsert=True)
+    except DuplicateKeyError:
+        # A concurrent upload of the same run inserted it first, the unique
+        # index makes the retry replace it
+        return db.run.replace_one(run_key, run, upsert=True)
+
+
+def _bulk_write(collection, requests, retry=None):
+    """
+    Writes requests unordered. Requests that fail on a duplicate key, as
+    an upsert racing a concurrent upload does, are tried once more if
+    retry(i) says so. Returns the _id upserted by request i, and the write
+    error of each request i that failed, as two dicts.
+    """
+    upserted, failed = {}, {}
+    pending = range(len(requests))
+    for attempt in range(2):
+        if not pending:
+            break
+        try:
+            result = collection.bulk_write([requests[i] for i in pending],
+                                           ordered=False)
+            upserted.update((pending[j], _id)
+                            for j, _id in result.upserted_ids.items())
+            errors = []
+        except BulkWriteError, e:
+            upserted.update((pending[u["index"]], u["_id"])
+                            for u in e.details["upserted"])
+            errors = [(pending[w["index"]], w)
+                      for w in e.details["writeErrors"]]
+        pending = []
+        for i, error in errors:
+            if (attempt == 0 and error["code"] == 11000 and
+                    (retry is None or retry(i))):
+                pending.append(i)
+            else:
+                failed[i] = error
+    return upserted, failed
+
+
+def _check_run(run):
+    # Returns what is wrong with the fields of a run for add_runs, if anything
+    if not isinstance(run, dict):
+        return Exception("A run should be an object.")
+    missing = [f for f in ["qid", "runid", "doclist"] if f not in run]
+    if missing:
+        return Exception("Please specify field(s): '%s'." % ", ".join(missing))
+    if not isinstance(run["qid"], basestring):
+        return Exception("The qid should be a string.")
+    if not isinstance(run["doclist"], list) or \
+            not all(isinstance(d, dict) and "docid" in d
+                    for d in run["doclist"]):
+        return Exception("Please specify a docid for each document in the "
+                         "doclist.")
+    return None
+
+
+def add_runs(key, runs):
+    """
+    Stores many runs, each a dict with a qid, runid and doclist, like
+    add_run does one at a time. The queries, the documents of each site and
+    the active runs are read with one query each. The runs are written with
+    one bulk write, and the active runs with one for test runs during a
+    test period and one for the others. A run that can not be stored does
+    not keep the others from being stored.
+
+    Returns a (run, error) pair for each run, in order. error is None if
+    the run was stored, or the ValueError (conflict), LookupError (not
+    found) or other exception add_run would have raised for it. Runs with
+    missing fields get an Exception.
+    """
+    results = [(run, _check_run(run)) for run in runs]
+    submitted = Counter(run["qid"] for run, error in results if error is None)
+    queries = dict((q["_id"], q)
+                   for q in db.query.find({"_id": {"$in": submitted.keys()}}))
+    only_once, active = set(), set()
+    if _in_test_period():
+        only_once = set(qid for qid, q in queries.items()
+                        if q.get("type") == "test")
+    if only_once:
+        active = set(a["qid"] for a in db.active_run.find(
+            {"_id": {"$in": [_active_run_id(qid, key) for qid in only_once]}},
+            {"qid": True}))
+    sites = user.get_sites(key)
+
+    valid = []
+    for i, run in enumerate(runs):
+        if results[i][1] is not None:
+            continue
+        q = queries.get(run["qid"])
+        if not q:
+            error = LookupError("Query does not exist: qid = '%s'"
+                                % run["qid"])
+        elif submitted[run["qid"]] > 1:
+            error = ValueError("Only submit one run per query: qid = '%s'"
+                               % run["qid"])
+        elif run["qid"] in active:
+            error = ValueError("For test queries you can only upload a run "
+                               "once during a test period.")
+        elif q["site_id"] not in sites:
+            error = LookupError("First sign up for site %s." % q["site_id"])
+        elif len(run["doclist"]) == 0:
+            error = ValueError("The doclist should contain documents.")
+        else:
+            valid.append(i)
+            continue
+        results[i] = (run, error)
 
-    if "runs" not in q or key not in q["runs"]:
+    # One lookup per site for the documents of all runs
+    site_docids = {}
+    for i in valid:
+        site_docids.setdefault(queries[runs[i]["qid"]]["site_id"], set()
+                               ).update(d["docid"] for d in runs[i]["doclist"])
+    for site_id, docids in site_docids.items():
+        site_docids[site_id] = doc.resolve_docids(site_id, list(docids))
+
+    stored = []
+    creation_time = datetime.datetime.now()
+    for i in valid:
+        q = queries[runs[i]["qid"]]
+        doclist = runs[i]["doclist"]
+        missing = [d["docid"] for d in doclist
+                   if d["docid"] not in site_docids[q["site_id"]]]
+        if missing:
+            results[i] = (runs[i], LookupError(
+                "Document not found: docid = '%s'. Only submit runs with "
+                "existing documents." % missing[0]))
+            continue
+        for d in doclist:
+            d["site_docid"] = site_docids[q["site_id"]][d["docid"]]
+        run = {
+            "userid": key,
+            "qid": q["_id"],
+            "site_qid": q["site_qid"],
+            "site_id": q["site_id"],
+            "runid": runs[i]["runid"],
+            "doclist": doclist,
+            "creation_time": creation_time,
+        }
+        results[i] = (run, None)
+        stored.append(i)
+
+    # Test runs claim their active run before they are stored, and the other
+    # runs are stored before they are pointed to, as in add_run
+    claimed = [i for i in stored if results[i][0]["qid"] in only_once]
+    requests = []
+    for i in claimed:
+        active_run = _active_run(results[i][0])
+        active_run["_id"] = _active_run_id(results[i][0]["qid"], key)
+        requests.append(pymongo.InsertOne(active_run))
+    _, failed = _bulk_write(db.active_run, requests, retry=lambda j: False)
+    for j, error in failed.items():
+        if error["code"] == 11000:
+            # A concurrent upload for this test query got there first
+            error = ValueError("For test queries you can only upload a run "
+                               "once during a test period.")
+        else:
+            error = Exception(error["errmsg"])
+        results[claimed[j]] = (results[claimed[j]][0], error)
+    failed = set(claimed[j] for j in failed)
+    stored = [i for i in stored if i not in failed]
+
+    upserted, failed = _bulk_write(db.run, [
+        pymongo.ReplaceOne({"runid": results[i][0]["runid"],
+                            "qid": results[i][0]["qid"],
+                            "userid": key}, results[i][0], upsert=True)
+        for i in stored])
+    for j, error in failed.items():
+        i = stored[j]
+        if results[i][0]["qid"] in only_once:
+            db.active_run.delete_one(
+                {"_id": _active_run_id(results[i][0]["qid"], key),
+                 "creation_time": creation_time})
+        results[i] = (results[i][0], Exception(error["errmsg"]))
+    upserted = dict((stored[j], _id) for j, _id in upserted.items())
+    stored = [i for j, i in enumerate(stored)
+              if j not in failed and results[i][0]["qid"] not in only_once]
+
+    _, failed = _bulk_write(db.active_run, [
+        pymongo.UpdateOne({"_id": _active_run_id(results[i][0]["qid"], key)},
+                          {"$set": _active_run(results[i][0])}, upsert=True)
+        for i in stored])
+    for j, error in failed.items():
+        i = stored[j]
+        if i in upserted:
+            db.run.delete_one({"_id": upserted.pop(i)})
+        results[i] = (results[i][0], Exception(error["errmsg"]))
+
+    new_runs = {}
+    for i in upserted:
+        site_id = results[i][0]["site_id"]
+        new_runs[site_id] = new_runs.get(site_id, 0) + 1
+    for site_id, n in new_runs.items():
+        stats.count_runs(key, site_id, n)
+    for run, error in results:
+        if error is None:
+            pool.invalidate(run["site_id"], run["site_qid"])
+    return results
+
+
+def _find_active_run(key, qid):
+    active_run = get_active_run(key, qid)
+    if not active_run:
+        if not db.query.find_one({"_id": qid}, {"_id": True}):
+            raise LookupError("Query does not exist: qid = '%s'" % qid)
         raise LookupError("No run for this query: qid = '%s'" % qid)
+    return active_run
+
 
-    runid = q["runs"][key][0]
+def get_run(key, qid):
+    runid = _find_active_run(key, qid)["runid"]
 
     run = db.run.find_one({"userid": key,
                            "qid": qid,
@@ -136,6 +389,17 @@ def get_run(key, qid):
     return run
 
 
+def get_run_version(key, qid):
+    """
+    Returns the state and creation time of the current run of a participant
+    for a query, without reading the run itself.
+    """
+    active_run = _find_active_run(key, qid)
+    runid = active_run["runid"]
+    creation_time = active_run.get("creation_time")
+    return (qid, runid, creation_time), creation_time
+
+
 def get_trec_run(runs, periodname, teamname):
     runname = slugify.slugify(unicode("%s %s" % (periodname, teamname)))
     trec = []
@@ -232,141 +496,155 @@ def get_trec(site_id):
     return trec_runs, trec_qrels, trec_qrels_raw
 
 
-# Remove all runs submitted by a certain participant
+# Remove all runs submitted by a certain participant. The runs are kept,
+# they are just no longer active. Returns the number of deactivated runs.
 def remove_runs_user(key):
-    q = {"deleted": {"$ne": True}}
-    queries = [query for query in db.query.find(q)]
-    # print "Before"
-    # print queries
-    for query in queries:
-        if "runs" in query:
-            runs = query["runs"]
-            if key in runs:
-                print "Removing runid " + runs[key]
-                del runs[key]
-
-            # Update runs list
-            query["runs"] = runs
-            db.query.save(query)
-    # print "After"
-    # print [query for query in db.query.find(q)]
-
-    # Return resulting query list, with removed runs
-    return [query for query in db.query.find(q)]
-
-
-# Get all runs by a certain user
+    removed = db.active_run.delete_many({"userid": key}).deleted_count
+    pool.invalidate()
+    return removed
+
+
+# Get all runs by a certain user, as (runid, creation_time) pairs
 def get_runs(key):
-    q = {"deleted": {"$ne": True}}
-    queries = [query for query in db.query.find(q)]
-    runs_user = []
-    for query in queries:
-        if "runs" in query:
-            runs = query["runs"]
-            if key in runs:
-                runs_user.append(runs[key])
-    return runs_user
+    return [(active_run["runid"], active_run.get("creation_time"))
+            for active_run in get_active_runs(key=key)]
+
+
+def migrate_active_runs():
+    """
+    Moves the runs maps embedded in queries by earlier versions to the
+    active_run collection. Returns the number of active runs moved.
+    """
+    moved = 0
+    for q in db.query.find({"runs": {"$exists": True}},
+                           {"runs": True, "site_id": True,
+                            "site_qid": True}):
+        requests = []
+        for userid, runid_pair in q["runs"].items():
+            # Check if runid is paired with a timestamp (new format)
+            if isinstance(runid_pair, (list, tuple)):
+                runid, creation_time = runid_pair
+            else:
+                # Only runid present (old format), can not be cleaned up
+                runid, creation_time = runid_pair, None
+            requests.append(pymongo.UpdateOne(
+                {"_id": _active_run_id(q["_id"], userid)},
+                {"$setOnInsert": {"qid": q["_id"],
+                                  "userid": userid,
+                                  "site_id": q["site_id"],
+                                  "site_qid": q["site_qid"],
+                                  "runid": runid,
+                                  "creation_time": creation_time}},
+                upsert=True))
+        if requests:
+            db.active_run.bulk_write(requests, ordered=False)
+        db.query.update_one({"_id": q["_id"]}, {"$unset": {"runs": ""}})
+        moved += len(requests)
+    if moved:
+        pool.invalidate()
+    return moved
+
+
+def _get_old_runs(reactivation_period, selected_user=None):
+    """
+    Returns the current runs that are older than the age threshold, and
+    those that are older than the doclist of their query, both plus
+    reactivation_period. Candidates come from an indexed query on the
+    active run creation times, plus one per batch of queries whose doclist
+    changed after the age threshold, with the cutoff of each query. Their
+    queries are read with one more query.
+    """
+    age_threshold = datetime.datetime.now() - datetime.timedelta(days=config["RUN_AGE_THRESHOLD_DAYS"]) - reactivation_period
+
+    # Active runs without a creation time (old format) are never matched,
+    # they can not be cleaned up
+    q = {"creation_time": {"$lt": age_threshold}}
+    if selected_user is not None:
+        q["userid"] = selected_user
+    candidates = dict((a["_id"], a) for a in db.active_run.find(q))
+    # Runs older than the doclist of a query whose doclist is older than
+    # the age threshold are among the candidates already
+    recent_doclists = list(db.query.find(
+        {"deleted": {"$ne": True},
+         "doclist_modified_time": {"$gt": age_threshold + reactivation_period}},
+        {"doclist_modified_time": True}))
+    for i in range(0, len(recent_doclists), 1000):
+        q = {"$or": [{"qid": query["_id"],
+                      "creation_time": {"$lt": query["doclist_modified_time"] -
+                                        reactivation_period}}
+                     for query in recent_doclists[i:i + 1000]]}
+        if selected_user is not None:
+            q["userid"] = selected_user
+        for active_run in db.active_run.find(q):
+            candidates[active_run["_id"]] = active_run
+    candidates = candidates.values()
+    queries = dict((query["_id"], query) for query in db.query.find(
+        {"_id": {"$in": list(set(a["qid"] for a in candidates))},
+         "deleted": {"$ne": True}},
+        {"doclist_modified_time": True}))
+    runs = {}
+    for i in range(0, len(candidates), 1000):
+        for run in db.run.find({"$or": [{"userid": a["userid"],
+                                         "qid": a["qid"],
+                                         "runid": a["runid"]}
+                                        for a in candidates[i:i + 1000]]}):
+            runs[_active_run_id(run["qid"], run["userid"])] = run
+
+    metrics.incr("cleanup.queries_scanned", len(queries))
+    metrics.incr("cleanup.runs_examined", len(candidates))
+
+    old_runs_age = []
+    old_runs_doclist = []
+    for active_run in candidates:
+        query = queries.get(active_run["qid"])
+        run = runs.get(active_run["_id"])
+        if not query or not run:
+            continue
+        run_modified_time = active_run["creation_time"]
+        if ('doclist_modified_time' in query and
+                run_modified_time < query['doclist_modified_time'] - reactivation_period):
+            log.debug("Run %s of %s for %s modified %s is older than its "
+                      "doclist, modified %s", run["runid"], run["userid"],
+                      run["qid"], run_modified_time,
+                      query['doclist_modified_time'])
+            old_runs_doclist.append(run)
+        elif run_modified_time < age_threshold:
+            log.debug("Run %s of %s for %s modified %s is older than %s",
+                      run["runid"], run["userid"], run["qid"],
+                      run_modified_time, age_threshold)
+            old_runs_age.append(run)
+    return (old_runs_age, old_runs_doclist)
+
 
 # Get outdated runs which are past the reactivation period and can be deleted.
 # With argument: get runs for specific user. Without argument: get all deletable runs
 def get_deletable_runs(selected_user=None):
-    age_threshold = datetime.datetime.now() - datetime.timedelta(days=config["RUN_AGE_THRESHOLD_DAYS"])
     reactivation_period = datetime.timedelta(days=config["REACTIVATION_PERIOD_DAYS"])
-
-    # Get list of all queries
-    q = {"deleted": {"$ne": True}}
-    queries = [query for query in db.query.find(q)]
-    deletable_runs_age = []
-    deletable_runs_doclist = []
-    for query in queries:
-        allruns = query.get("runs", {}).items()
-        for userid, runid_pair in allruns:
-            print userid
-            print selected_user
-            # If selected_user == None, no specific user is specified, and all outdated runs will be added
-            # If a user is selected, only outdated runs for this user will be added
-            if selected_user == None or userid == selected_user:
-                # Check if runid is paired with a timestamp (new format)
-                if isinstance(runid_pair, list):
-                    runid, run_modified_time = runid_pair
-                    if 'doclist_modified_time' in query:
-                        print "Run modified time: " + str(run_modified_time)
-                        print "Doclist modified time: " + str(query['doclist_modified_time'])
-                        if run_modified_time < (query['doclist_modified_time'] - reactivation_period):
-                            print("Run older than latest doclist")
-                            # Look up full run and append this to deletable runs list
-                            full_run = db.run.find_one({"runid": runid,
-                                                        "qid": query['_id'],
-                                                        "userid": userid})
-                            deletable_runs_doclist.append(full_run)
-
-                            continue
-                    if run_modified_time < (age_threshold - reactivation_period):
-
-                        print "Run older than threshold + reactivation period."
-                        print "Run modified time: " + str(run_modified_time)
-                        print "Age threshold - reaction period: " + str(age_threshold - reactivation_period)
-                        # Look up full run and append this to deletable runs list
-                        full_run = db.run.find_one({"runid": runid,
-                                                    "qid": query['_id'],
-                                                    "userid": userid})
-                        deletable_runs_age.append(full_run)
-
-                        continue
-                else:
-                    print("Run not paired with timestamp, not able to clean up")
-                    continue
-
-    return (deletable_runs_age, deletable_runs_doclist)
+    return _get_old_runs(reactivation_period, selected_user)
 
 
 # Get all outdated runs: runs which are older than their doclist or older than a threshold
 # With argument: get runs for specific user. Without argument: get all outdated runs
 def get_outdated_runs(selected_user=None):
-    age_threshold = datetime.datetime.now() - datetime.timedelta(days=config["RUN_AGE_THRESHOLD_DAYS"])
-
-    # Get list of all queries
-    q = {"deleted": {"$ne": True}}
-    queries = [query for query in db.query.find(q)]
-    outdated_runs_age = []
-    outdated_runs_doclist = []
-    for query in queries:
-        allruns = query.get("runs", {}).items()
-        for userid, runid_pair in allruns:
-            print userid
-            print selected_user
-            # If selected_user == None, no specific user is specified, and all outdated runs will be added
-            # If a user is selected, only outdated runs for this user will be added
-            if selected_user == None or userid == selected_user:
-                # Check if runid is paired with a timestamp (new format)
-                if isinstance(runid_pair, list):
-                    runid, run_modified_time = runid_pair
-                    if 'doclist_modified_time' in query:
-                        print "Run modified time: " + str(run_modified_time)
-                        print "Doclist modified time: " + str(query['doclist_modified_time'])
-                        if run_modified_time < query['doclist_modified_time']:
-                            print("Run older than latest doclist")
-                            # Look up full run and append this to outdated runs list
-                            full_run = db.run.find_one({"runid": runid,
-                                                        "qid": query['_id'],
-                                                        "userid": userid})
-                            outdated_runs_doclist.append(full_run)
-
-                            continue
-                    if run_modified_time < age_threshold:
-                        print("Run older than threshold")
-                        # Look up full run and append this to outdated runs list
-                        full_run = db.run.find_one({"runid": runid,
-                                                    "qid": query['_id'],
-                                                    "userid": userid})
-                        outdated_runs_age.append(full_run)
-
-                        continue
-                else:
-                    print("Run not paired with timestamp, not able to clean up")
-                    continue
-
-    return (outdated_runs_age, outdated_runs_doclist)
+    return _get_old_runs(datetime.timedelta(0), selected_user)
+
+
+def deactivate_runs(runs):
+    """
+    Deactivates runs, in one bulk write, unless they were replaced in the
+    meantime. The runs themselves are kept.
+    """
+    if not runs:
+        return
+    requests = [pymongo.DeleteOne({"_id": _active_run_id(run["qid"],
+                                                         run["userid"]),
+                                   "runid": run["runid"]})
+                for run in runs]
+    result = db.active_run.bulk_write(requests, ordered=False)
+    metrics.incr("cleanup.runs_deleted", result.deleted_count)
+    for site_id, site_qid in set((run["site_id"], run["site_qid"])
+                                 for run in runs):
+        pool.invalidate(site_id, site_qid)
 
 # Reactivate designated outdated runs
 def reactivate_runs(runs):
@@ -378,28 +656,18 @@ def reactivate_runs(runs):
         new_run = dict(run) # copy of current run
         new_run["creation_time"] = new_creation_time
 
-        db.run.remove(run)
-        db.run.save(new_run)
+        db.run.update_one({"_id": run["_id"]},
+                          {"$set": {"creation_time": new_creation_time}})
 
         qid = run["qid"]
         userid = run["userid"]
-        q = db.query.find_one({"_id": qid})
         runid = run["runid"]
 
-        if not q:
+        if not db.query.find_one({"_id": qid}, {"_id": True}):
             raise LookupError("Query does not exist: qid = '%s'" % qid)
-        if "runs" in q:
-            runs = q["runs"]
-        else:
-            runs = {}
-        runs[userid] = (runid, new_creation_time)
-
-        q["runs"] = runs
-        db.query.save(q)
-        print "Updated run"
-        print new_run
-        print "Updated query runs"
-        print runs
+        _set_active_run(new_run)
+        pool.invalidate(run["site_id"], run["site_qid"])
+        log.debug("Reactivated run %s of %s for %s", runid, userid, qid)
 
         reactivated_runs += new_run
     return reactivated_runs
@@ -0,0 +1,79 @@
+# This file is part of Living Labs Challenge, see http://living-labs.net.
+#
+# Living Labs Challenge is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Living Labs Challenge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Living Labs Challenge. If not, see <http://www.gnu.org/licenses/>.
+
+# Least-served scheduling of participant runs. For every query a heap of
+# [impressions, tiebreak, userid] is kept, so the participant that was shown
+# least often is found in O(log n). Impressions are counted in memory and
+# written to the schedule collection in batches.
+
+import heapq
+import random
+import threading
+from pymongo import UpdateOne
+from db import db
+from config import config
+
+_pending = {}
+_lock = threading.Lock()
+
+
+def _schedule_id(qid, userid):
+    return "%s/%s" % (qid, userid)
+
+
+def schedule(qid, userids):
+    served = {}
+    ids = [_schedule_id(qid, userid) for userid in userids]
+    for s in db.schedule.find({"_id": {"$in": ids}}):
+        served[s["userid"]] = s["impressions"]
+    heap = []
+    with _lock:
+        for userid in userids:
+            impressions = served.get(userid, 0) + _pending.get((qid, userid), 0)
+            heap.append([impressions, random.random(), userid])
+    heapq.heapify(heap)
+    return heap
+
+
+def next(qid, heap):
+    with _lock:
+        impressions, _, userid = heap[0]
+        heapq.heapreplace(heap, [impressions + 1, random.random(), userid])
+        _pending[(qid, userid)] = _pending.get((qid, userid), 0) + 1
+        npending = len(_pending)
+    if npending >= config["SCHEDULE_FLUSH_SIZE"]:
+        flush()
+    return userid
+
+
+def flush():
+    with _lock:
+        pending = dict(_pending)
+        _pending.clear()
+    if not pending:
+        return
+    requests = [UpdateOne({"_id": _schedule_id(qid, userid)},
+                          {"$set": {"qid": qid, "userid": userid},
+                           "$inc": {"impressions": impressions}},
+                          upsert=True)
+                for (qid, userid), impressions in pending.items()]
+    try:
+        db.schedule.bulk_write(requests, ordered=False)
+    except Exception:
+        # Keep the impressions around for the next flush
+        with _lock:
+            for k, impressions in pending.items():
+                _pending[k] = _pending.get(k, 0) + impressions
+        raise
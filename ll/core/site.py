@@ -14,7 +14,9 @@
 # along with Living Labs Challenge. If not, see <http://www.gnu.org/licenses/>.
 
 import argparse
+import threading
 from db import db
+from config import config
 import user
 
 
@@ -38,7 +40,7 @@ def set_site(key, short, name, url, terms):
         "enabled": False,
         "is_robot": False})
     u["site_id"] = site
-    db.user.save(u)
+    user.save_user(u)
 
 
 def get_site(site_id):
@@ -49,25 +51,38 @@ def get_sites():
     return db.site.find()
 
 
+# Identifiers are handed out from blocks of ID_BLOCK_SIZE that are reserved
+# per process with a single $inc, so allocating an id does not contend on the
+# site document. Unused ids of a block are lost when the process stops.
+_id_blocks = {}
+_id_lock = threading.Lock()
+
+
+def _next_id(site_id, counter):
+    with _id_lock:
+        block = _id_blocks.get((site_id, counter))
+        if block is None or block[0] > block[1]:
+            size = config["ID_BLOCK_SIZE"]
+            ret = db.site.find_and_modify({"_id": site_id},
+                                          update={"$inc": {counter: size}},
+                                          new=True)
+            block = [ret[counter] - size + 1, ret[counter]]
+            _id_blocks[(site_id, counter)] = block
+        next_id = block[0]
+        block[0] += 1
+    return next_id
+
+
 def next_qid(site_id):
-    ret = db.site.find_and_modify({"_id": site_id},
-                                  update={"$inc": {"qid_counter": 1}},
-                                  new=True)
-    return "%s-q%d" % (site_id, ret["qid_counter"])
+    return "%s-q%d" % (site_id, _next_id(site_id, "qid_counter"))
 
 
 def next_docid(site_id):
-    ret = db.site.find_and_modify({"_id": site_id},
-                                  update={"$inc": {"docid_counter": 1}},
-                                  new=True)
-    return "%s-d%d" % (site_id, ret["docid_counter"])
+    return "%s-d%d" % (site_id, _next_id(site_id, "docid_counter"))
 
 
 def next_sid(site_id):
-    ret = db.site.find_and_modify({"_id": site_id},
-                                  update={"$inc": {"sid_counter": 1}},
-                                  new=True)
-    return "%s-s%d" % (site_id, ret["sid_counter"])
+    return "%s-s%d" % (site_id, _next_id(site_id, "sid_counter"))
 
 
 def enable(site_id):
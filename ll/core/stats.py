@@ -0,0 +1,170 @@
+# This file is part of Living Labs Challenge, see http://living-labs.net.
+#
+# Living Labs Challenge is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Living Labs Challenge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Living Labs Challenge. If not, see <http://www.gnu.org/licenses/>.
+
+# Dashboard counters, stored in the stats collection. They are incremented
+# when docs, queries, runs, sessions and clicks are added; increments are
+# collected in memory and written in batches. The periodic statistics job
+# only reconciles the counters with the actual collections and stores the
+# admin overview. Reads are cached for STATS_CACHE_SECONDS, so dashboard
+# pages do not hit the database on every request.
+
+import time
+import threading
+from pymongo import UpdateOne
+from db import db
+from config import config
+
+SITE_FIELDS = ["query", "doc", "impression", "click"]
+PARTICIPANT_FIELDS = ["run", "impression", "click"]
+
+_pending = {}
+_lock = threading.Lock()
+_flushed = time.time()
+_cache = {}
+_cache_lock = threading.Lock()
+
+ADMIN_STATS_ID = "admin"
+
+
+def site_stats_id(site_id):
+    return "site/%s" % site_id
+
+
+def participant_stats_id(userid):
+    return "participant/%s" % userid
+
+
+def participant_site_stats_id(userid, site_id):
+    return "participant/%s/%s" % (userid, site_id)
+
+
+def _incr(stats_ids, field, n):
+    if not n:
+        return
+    with _lock:
+        for stats_id in stats_ids:
+            counts = _pending.setdefault(stats_id, {})
+            counts[field] = counts.get(field, 0) + n
+        flush = (len(_pending) >= config["STATS_FLUSH_SIZE"] or
+                 time.time() - _flushed > config["STATS_FLUSH_SECONDS"])
+    if flush:
+        flush_stats()
+
+
+def flush_stats():
+    global _flushed
+    with _lock:
+        pending = dict(_pending)
+        _pending.clear()
+        _flushed = time.time()
+    if not pending:
+        return
+    requests = [UpdateOne({"_id": stats_id}, {"$inc": counts}, upsert=True)
+                for stats_id, counts in pending.items()]
+    try:
+        db.stats.bulk_write(requests, ordered=False)
+    except Exception:
+        # Keep the increments around for the next flush
+        with _lock:
+            for stats_id, counts in pending.items():
+                for field, n in counts.items():
+                    current = _pending.setdefault(stats_id, {})
+                    current[field] = current.get(field, 0) + n
+        raise
+
+
+def count_docs(site_id, n=1):
+    _incr([site_stats_id(site_id)], "doc", n)
+
+
+def count_queries(site_id, n=1):
+    _incr([site_stats_id(site_id)], "query", n)
+
+
+def count_runs(userid, site_id, n=1):
+    _incr([participant_stats_id(userid),
+           participant_site_stats_id(userid, site_id)], "run", n)
+
+
+def count_impressions(userid, site_id, n=1):
+    _incr([site_stats_id(site_id),
+           participant_stats_id(userid),
+           participant_site_stats_id(userid, site_id)], "impression", n)
+
+
+def count_clicks(userid, site_id, n):
+    _incr([site_stats_id(site_id),
+           participant_stats_id(userid),
+           participant_site_stats_id(userid, site_id)], "click", n)
+
+
+def get_clicks(doclist):
+    return len([d for d in doclist if "clicked" in d and d["clicked"]])
+
+
+def _read(stats_id):
+    now = time.time()
+    with _cache_lock:
+        cached = _cache.get(stats_id)
+    if cached is not None and cached[0] > now:
+        return cached[1]
+    found = db.stats.find_one({"_id": stats_id})
+    with _cache_lock:
+        _cache[stats_id] = (now + config["STATS_CACHE_SECONDS"], found)
+    return found
+
+
+def _get(stats_id, fields):
+    stats = dict((f, 0) for f in fields)
+    found = _read(stats_id)
+    if found:
+        stats.update((f, found[f]) for f in fields if f in found)
+    return stats
+
+
+def get_site(site_id):
+    return _get(site_stats_id(site_id), SITE_FIELDS)
+
+
+def get_participant(userid):
+    return _get(participant_stats_id(userid), PARTICIPANT_FIELDS)
+
+
+def get_participant_site(userid, site_id):
+    stats = get_site(site_id)
+    stats.update(_get(participant_site_stats_id(userid, site_id),
+                      PARTICIPANT_FIELDS))
+    return stats
+
+
+def get_admin():
+    """Returns the admin overview, or None if it was not calculated yet."""
+    found = _read(ADMIN_STATS_ID)
+    if found:
+        found = dict(found)
+        del found["_id"]
+    return found
+
+
+def set_stats(stats_id, stats):
+    db.stats.update_one({"_id": stats_id}, {"$set": stats}, upsert=True)
+    with _cache_lock:
+        _cache.pop(stats_id, None)
+
+
+def set_admin(stats):
+    db.stats.replace_one({"_id": ADMIN_STATS_ID}, stats, upsert=True)
+    with _cache_lock:
+        _cache.pop(ADMIN_STATS_ID, None)
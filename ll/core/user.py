@@ -18,38 +18,62 @@ import string
 import hashlib
 import datetime
 import smtplib
+import threading
+import time
 from email.mime.text import MIMEText
 from werkzeug import generate_password_hash
 from db import db
 from config import config
 
+# Users are cached per process for USER_CACHE_SECONDS, as every API request
+# looks up its key, often more than once. Changes made through this module
+# invalidate the cache of the process that makes them; other processes see
+# them once the entry expires.
+_users = {}
+_users_lock = threading.Lock()
+
+
+def _email_message(user, txt):
+    msgtxt = "Hi %s,\n\n" % user["teamname"]
+    msgtxt += txt
+    msgtxt += "\n\n"
+    msgtxt += "Some relevant urls:\n"
+    msgtxt += "Website: %s\n" % config["URL_WEB"]
+    msgtxt += "API: %s\n" % config["URL_API"]
+    msgtxt += "Dashboard: %s\n" % config["URL_DASHBOARD"]
+    msgtxt += "Documentation: %s\n" % config["URL_DOC"]
+    msgtxt += "Code: %s\n" % config["URL_GIT"]
+    msgtxt += "\n\n"
+    msgtxt += "Please do not hesitate to ask any questions.\n"
+    msgtxt += "\n\n"
+    msgtxt += "With regards,\n"
+    msgtxt += "The organizers"
+    return msgtxt
+
 
 def send_email(user, txt, subject):
+    return send_emails([(user, txt, subject)])
+
+
+def send_emails(emails):
+    """
+    Sends a list of (user, txt, subject) emails over a single SMTP
+    connection.
+    """
     if not config["SEND_EMAIL"]:
         return False
+    if not emails:
+        return True
     try:
-        msgtxt = "Hi %s,\n\n" % user["teamname"]
-        msgtxt += txt
-        msgtxt += "\n\n"
-        msgtxt += "Some relevant urls:\n"
-        msgtxt += "Website: %s\n" % config["URL_WEB"]
-        msgtxt += "API: %s\n" % config["URL_API"]
-        msgtxt += "Dashboard: %s\n" % config["URL_DASHBOARD"]
-        msgtxt += "Documentation: %s\n" % config["URL_DOC"]
-        msgtxt += "Code: %s\n" % config["URL_GIT"]
-        msgtxt += "\n\n"
-        msgtxt += "Please do not hesitate to ask any questions.\n"
-        msgtxt += "\n\n"
-        msgtxt += "With regards,\n"
-        msgtxt += "The organizers"
-        msg = MIMEText(msgtxt)
-        msg['subject'] = "[Living Labs for %s] %s" % (config["COMPETITION_NAME"],subject)
         email_from = config["EMAIL_FROM"]
-        email_to = user['email']
-        msg['From'] = email_from
-        msg['To'] = email_to
         s = smtplib.SMTP('localhost')
-        s.sendmail(email_from, [email_to], msg.as_string())
+        for user, txt, subject in emails:
+            msg = MIMEText(_email_message(user, txt))
+            msg['subject'] = "[Living Labs for %s] %s" % (config["COMPETITION_NAME"],subject)
+            email_to = user['email']
+            msg['From'] = email_from
+            msg['To'] = email_to
+            s.sendmail(email_from, [email_to], msg.as_string())
         s.quit()
         return True
     except:
@@ -166,16 +190,16 @@ def new_user(teamname, email, password=None):
 
 
 def verify_user(key):
-    user = get_user(key)
+    user = _find_user(key)
     user["is_verified"] = True
     send_verification_email(user)
-    db.user.save(user)
+    save_user(user)
 
 
 def unverify_user(key):
-    user = get_user(key)
+    user = _find_user(key)
     user["is_verified"] = False
-    db.user.save(user)
+    save_user(user)
 
 
 def reset_password(email):
@@ -183,22 +207,50 @@ def reset_password(email):
     password = random_string(config["PASSWORD_LENGHT"])
     user["password"] = generate_password_hash(password)
     send_password_email(user, password, subject="Password Reset")
-    db.user.save(user)
+    save_user(user)
 
 
 def set_admin(key):
-    user = get_user(key)
+    user = _find_user(key)
     user["is_admin"] = True
+    save_user(user)
+
+
+def save_user(user):
     db.user.save(user)
+    invalidate(user["_id"])
 
 
-def get_user(key):
+def invalidate(key=None):
+    with _users_lock:
+        if key is None:
+            _users.clear()
+        else:
+            _users.pop(key, None)
+
+
+def _find_user(key):
+    # Users that are about to be changed are always read from the database
     user = db.user.find_one({"_id": key})
     if not user:
         raise Exception("No such user.")
     return user
 
 
+def get_user(key):
+    now = time.time()
+    with _users_lock:
+        cached = _users.get(key)
+    if cached is not None and cached[0] > now:
+        user = cached[1]
+    else:
+        user = _find_user(key)
+        with _users_lock:
+            _users[key] = (now + config["USER_CACHE_SECONDS"], user)
+    # Callers may change the returned user, the cached one stays intact
+    return dict(user)
+
+
 def get_user_by_email(email):
     user = db.user.find_one({"email": email})
     if not user:
@@ -215,14 +267,15 @@ def get_participants():
 
 
 def delete_user(key):
-    user = get_user(key)
-    db.user.remove(user)
+    user = _find_user(key)
+    db.user.remove({"_id": user["_id"]})
+    invalidate(key)
 
 
 def set_sites(key, sites):
-    user = get_user(key)
+    user = _find_user(key)
     user["signed_up_for"] = sites
-    db.user.save(user)
+    save_user(user)
 
 
 def get_sites(key):
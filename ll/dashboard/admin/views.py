@@ -15,8 +15,6 @@
 
 from flask import Blueprint, request, render_template, flash, g, session, redirect, url_for
 import json
-import os
-import pickle
 import pymongo
 from .. import core, requires_login
 
@@ -31,46 +29,22 @@ def admin():
     if not g.user["is_admin"]:
         flash(u'You need to be admin for this page.', 'alert-warning')
         return redirect("/")
-    participants = core.user.get_participants()
-    queries = core.query.get_query()
-    sites = [s for s in core.site.get_sites()]
-    active_participants = set()
-    site_participants = {}
-    site_queries = {}
-    for query in queries:
-        if not query["site_id"] in site_participants:
-            site_participants[query["site_id"]] = [set(), set()]
-        if not query["site_id"] in site_queries:
-            site_queries[query["site_id"]] = [0, 0]
-        if "runs" in query:
-            if "type" in query and query["type"] == "test":
-                site_queries[query["site_id"]][1] += 1
-            else:
-                site_queries[query["site_id"]][0] += 1
-            for u in query["runs"]:
-                active_participants.add(u)
-                if "type" in query and query["type"] == "test":
-                    site_participants[query["site_id"]][1].add(u)
-                else:
-                    site_participants[query["site_id"]][0].add(u)
-
-    stats = {"participants": {"verified":  0,
-                              "all":  0,
-                              "active":  0
-                              },
-             "sites": {"runs": 0,
-                       "all":  0,
-                       "active": 0},
-             "queries": 0,
-             "per_site": {site["_id"]: {"participants": {"train": 0, "test":0},
-                                        "queries": {"train":0, "test":0}
-                                    } for site in sites
-                          }
-             }
-
-    stats_file = "stats_admin.p"
-    if os.path.isfile(stats_file):
-        stats = pickle.load(open(stats_file,"rb"))
+    stats = core.stats.get_admin()
+    if stats is None:
+        sites = core.site.get_sites()
+        stats = {"participants": {"verified":  0,
+                                  "all":  0,
+                                  "active":  0
+                                  },
+                 "sites": {"runs": 0,
+                           "all":  0,
+                           "active": 0},
+                 "queries": 0,
+                 "per_site": {site["_id"]: {"participants": {"train": 0, "test":0},
+                                            "queries": {"train":0, "test":0}
+                                        } for site in sites
+                              }
+                 }
 
     return render_template("admin/admin.html", user=g.user, stats=stats, config=core.config.config)
 
@@ -16,8 +16,6 @@
 from flask import Blueprint, request, render_template, flash, g, session, redirect, url_for
 import json
 from .. import core, requires_login
-import os
-import pickle
 
 mod = Blueprint('my', __name__, url_prefix='/my')
 
@@ -39,16 +37,7 @@ def my():
 def site(site_id):
     site = core.site.get_site(site_id)
 
-    stats = {"run": 0,
-             "query": 0,
-             "doc": 0,
-             "impression": 0,
-             "click": 0,
-             }
-
-    stats_file = "stats_participant_site_" + g.user["_id"] + "_" + site_id + ".p"
-    if os.path.isfile(stats_file):
-        stats = pickle.load(open(stats_file,"rb"))
+    stats = core.stats.get_participant_site(g.user["_id"], site_id)
 
     return render_template("my/site.html",
                            user=g.user,
@@ -15,8 +15,6 @@
 
 from flask import Blueprint, request, render_template, flash, g, session, redirect, url_for
 import json
-import pickle
-import os
 from .. import core, requires_login
 
 mod = Blueprint('participant', __name__, url_prefix='/participant')
@@ -34,23 +32,10 @@ def home():
 @requires_login
 def participant(email):
     participant = core.user.get_user_by_email(email)
-    #clicks = 0
-    #for feedback in feedbacks:
-    #    if not "doclist" in feedback:
-    #        continue
-    #    clicks += len([d for d in feedback["doclist"] if d["clicked"]])
-
-    stats = {
-             "run": 0,
-             "impression": 0,
-             #"click": 0,
-             "sites": [],
-    }
-
-    stats_file = "stats_participant_" + participant["_id"] + ".p"
-
-    if os.path.isfile(stats_file):
-        stats = pickle.load(open(stats_file,"rb"))
+    stats = core.stats.get_participant(participant["_id"])
+    participant_sites = core.user.get_sites(participant["_id"])
+    stats["sites"] = [s["name"] for s in core.site.get_sites()
+                      if s["_id"] in participant_sites]
 
     return render_template("participant/participant.html",
                            user=g.user,
@@ -17,8 +17,6 @@ from flask import Blueprint, request, render_template, flash, g, session, redire
 import json
 from .. import core, requires_login
 
-import os
-import pickle
 
 mod = Blueprint('site', __name__, url_prefix='/site')
 
@@ -40,14 +38,7 @@ def home():
 def site(site_id):
     site = core.site.get_site(site_id)
 
-    stats_file = "stats_site_" + site_id + ".p"
-
-    stats = {"query":0,
-             "doc":0,
-             "impression":0,
-             "click":0}
-    if os.path.isfile(stats_file):
-        stats = pickle.load(open(stats_file,"rb"))
+    stats = core.stats.get_site(site_id)
 
     return render_template("site/site.html",
                            user=g.user,
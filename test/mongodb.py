@@ -0,0 +1,92 @@
+# This file is part of Living Labs Challenge, see http://living-labs.net.
+#
+# Living Labs Challenge is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Living Labs Challenge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Living Labs Challenge. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import shutil
+import signal
+import socket
+import subprocess
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from ll import core
+
+DB_NAME = "lltest"
+
+
+def free_port():
+    s = socket.socket()
+    s.bind(("localhost", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def reset_core():
+    """
+    Drops what ll.core keeps in this process, so that neither cached ids and
+    users nor writes that are still buffered outlive the database of a test.
+    """
+    core.user.invalidate()
+    core.pool.invalidate()
+    with core.doc._docid_lock:
+        core.doc._docid_caches.clear()
+    with core.site._id_lock:
+        core.site._id_blocks.clear()
+    with core.feedback._sessions_lock:
+        core.feedback._sessions.clear()
+        core.feedback._flushing.clear()
+    with core.stats._lock:
+        core.stats._pending.clear()
+    with core.stats._cache_lock:
+        core.stats._cache.clear()
+    with core.scheduler._lock:
+        core.scheduler._pending.clear()
+
+
+class MongoTestCase(unittest.TestCase):
+    """
+    Runs the tests of a class against a throwaway mongod, without
+    authentication, and points core.db at it.
+    """
+
+    @classmethod
+    def setUpClass(self):
+        self.mongo_pid = 0
+        self.tempdir = tempfile.mkdtemp()
+        db_dir = os.path.join(self.tempdir, "db")
+        os.makedirs(db_dir)
+        self.port = free_port()
+        mongo_output = subprocess.check_output(["mongod", "--fork", "--syslog",
+                                                "--dbpath", db_dir,
+                                                "--port", str(self.port)])
+        # Real Mongo process will be forked, save for pid from output
+        for word in mongo_output.split():
+            if word.isdigit():
+                self.mongo_pid = int(word)
+        core.db.db.db = None
+        core.db.db.init_db("localhost", self.port, DB_NAME)
+
+    def setUp(self):
+        core.db.db.client.drop_database(DB_NAME)
+        reset_core()
+
+    @classmethod
+    def tearDownClass(self):
+        core.db.db.db = None
+        os.kill(self.mongo_pid, signal.SIGKILL)
+        shutil.rmtree(self.tempdir)
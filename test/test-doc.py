@@ -0,0 +1,116 @@
+# This file is part of Living Labs Challenge, see http://living-labs.net.
+#
+# Living Labs Challenge is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Living Labs Challenge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Living Labs Challenge. If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+
+from mongodb import MongoTestCase, core
+
+
+class TestResolveDocids(MongoTestCase):
+
+    def setUp(self):
+        super(TestResolveDocids, self).setUp()
+        core.doc._docid_caches.clear()
+        core.db.db.site.insert({"_id": "S1", "docid_counter": 0})
+        core.db.db.query.insert({"_id": "S1-q1", "site_id": "S1",
+                                 "site_qid": "q1"})
+        for i in range(3):
+            core.doc.add_doc("S1", "d%d" % i, {"title": "Document %d" % i,
+                                               "content": {}})
+
+    def tearDown(self):
+        core.stats.flush_stats()
+
+    def test_resolve(self):
+        docids = core.doc.resolve_site_docids("S1", ["d0", "d1", "d9"])
+        self.assertEqual(["d0", "d1"], sorted(docids))
+        site_docids = core.doc.resolve_docids("S1", docids.values())
+        self.assertEqual(["d0", "d1"], sorted(site_docids.values()))
+        self.assertEqual({}, core.doc.resolve_site_docids("S2", ["d0"]))
+
+    def test_deleted_in_other_process(self):
+        docids = core.doc.resolve_site_docids("S1", ["d0", "d1"])
+        # Another process deletes d0, the cache of this one still has it
+        core.db.db.doc.update_one({"_id": docids["d0"]},
+                                  {"$set": {"deleted": True}})
+        self.assertRaises(ValueError, core.doc.add_doclist, "S1", "q1",
+                          [{"site_docid": "d0"}, {"site_docid": "d1"}])
+        self.assertEqual(["d1"],
+                         sorted(core.doc.resolve_site_docids("S1",
+                                                             ["d0", "d1"])))
+        # Feedback and runs may still refer to deleted documents
+        self.assertEqual(["d0", "d1"], sorted(core.doc.resolve_site_docids(
+            "S1", ["d0", "d1"], include_deleted=True)))
+
+    def test_delete_doc(self):
+        core.doc.resolve_site_docids("S1", ["d0"])
+        core.doc.delete_doc("S1", "d0")
+        self.assertEqual({}, core.doc.resolve_site_docids("S1", ["d0"]))
+        core.doc.add_doc("S1", "d0", {"title": "Document 0", "content": {}})
+        self.assertEqual(["d0"],
+                         sorted(core.doc.resolve_site_docids("S1", ["d0"])))
+
+
+class TestAddDocs(MongoTestCase):
+
+    def setUp(self):
+        super(TestAddDocs, self).setUp()
+        core.doc._docid_caches.clear()
+        core.site._id_blocks.clear()
+        core.db.db.site.insert({"_id": "S1", "docid_counter": 0})
+
+    def tearDown(self):
+        core.site._id_blocks.clear()
+        core.stats.flush_stats()
+
+    def docs(self, site_docids):
+        return [{"site_docid": site_docid, "title": site_docid,
+                 "content": {"text": site_docid}}
+                for site_docid in site_docids]
+
+    def doc_count(self):
+        core.stats.flush_stats()
+        return core.db.db.stats.find_one(
+            {"_id": core.stats.site_stats_id("S1")})["doc"]
+
+    def test_add_docs(self):
+        self.assertEqual({"inserted": 3, "updated": 0},
+                         core.doc.add_docs("S1", self.docs(["a", "b", "c"])))
+        self.assertEqual({"inserted": 1, "updated": 2},
+                         core.doc.add_docs("S1", self.docs(["a", "c", "d"])))
+        self.assertEqual(4, core.db.db.doc.find().count())
+        self.assertEqual(4, self.doc_count())
+
+    def test_partial_failure(self):
+        # The second document gets an id that is taken already
+        core.db.db.doc.insert({"_id": "S1-d2", "site_id": "S1",
+                               "site_docid": "other"})
+        self.assertRaises(Exception, core.doc.add_docs, "S1",
+                          self.docs(["a", "b", "c"]))
+        # Only the document before the failing one is stored and counted
+        self.assertEqual(["a"], sorted(d["site_docid"] for d in
+                                       core.db.db.doc.find(
+                                           {"site_docid": {"$ne": "other"}})))
+        self.assertEqual(1, self.doc_count())
+        self.assertEqual(["a"], sorted(core.doc.resolve_site_docids(
+            "S1", ["a", "b", "c"])))
+        # Sending them again stores the rest
+        self.assertEqual({"inserted": 2, "updated": 1},
+                         core.doc.add_docs("S1", self.docs(["a", "b", "c"])))
+        self.assertEqual(3, self.doc_count())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,274 @@
+# This file is part of Living Labs Challenge, see http://living-labs.net.
+#
+# Living Labs Challenge is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Living Labs Challenge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Living Labs Challenge. If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+import threading
+import unittest
+
+from pymongo.errors import AutoReconnect
+
+from mongodb import MongoTestCase, core
+
+
+class FeedbackDatabase(object):
+    """
+    Stands in for core.db.db in core.feedback, and calls before_insert
+    before the sessions are written.
+    """
+
+    def __init__(self, before_insert):
+        self.feedback = FeedbackCollection(before_insert)
+
+    def __getattr__(self, name):
+        return getattr(core.db.db, name)
+
+
+class FeedbackCollection(object):
+
+    def __init__(self, before_insert):
+        self.before_insert = before_insert
+
+    def __getattr__(self, name):
+        return getattr(core.db.db.feedback, name)
+
+    def insert_many(self, sessions, ordered=True):
+        self.before_insert(sessions)
+        return core.db.db.feedback.insert_many(sessions, ordered=ordered)
+
+
+class TestSessionBuffer(MongoTestCase):
+
+    def setUp(self):
+        super(TestSessionBuffer, self).setUp()
+        self.flush_size = core.config.config["SESSION_FLUSH_SIZE"]
+        self.flush_seconds = core.config.config["SESSION_FLUSH_SECONDS"]
+        # Only flush when the tests ask for it
+        core.config.config["SESSION_FLUSH_SIZE"] = 1000
+        core.config.config["SESSION_FLUSH_SECONDS"] = 3600
+        core.feedback.flush_sessions()
+        for i in range(3):
+            core.db.db.doc.insert({"_id": "S1-d%d" % i, "site_id": "S1",
+                                   "site_docid": "d%d" % i})
+        core.db.db.query.insert({"_id": "S1-q1", "site_id": "S1",
+                                 "site_qid": "q1"})
+
+    def tearDown(self):
+        core.feedback.db = core.db.db
+        core.feedback.flush_sessions()
+        core.stats.flush_stats()
+        core.config.config["SESSION_FLUSH_SIZE"] = self.flush_size
+        core.config.config["SESSION_FLUSH_SECONDS"] = self.flush_seconds
+
+    def add_session(self, sid):
+        core.feedback.add_session({"_id": sid,
+                                   "site_id": "S1",
+                                   "site_qid": "q1",
+                                   "qid": "S1-q1",
+                                   "qtype": "train",
+                                   "runid": "r1",
+                                   "userid": "P1",
+                                   "creation_time": datetime.datetime.now()})
+
+    def add_feedback(self, sid):
+        doclist = [{"site_docid": "d%d" % i, "team": "participant",
+                    "clicked": i == 0} for i in range(3)]
+        return core.feedback.add_feedback("S1", sid, {"doclist": doclist})
+
+    def test_feedback_for_buffered_session(self):
+        self.add_session("S1-s1")
+        self.assertIsNone(core.db.db.feedback.find_one({"_id": "S1-s1"}))
+        self.add_feedback("S1-s1")
+        self.assertIn("doclist",
+                      core.db.db.feedback.find_one({"_id": "S1-s1"}))
+        # The flush does not write the session again
+        core.feedback.flush_sessions()
+        self.assertIn("doclist",
+                      core.db.db.feedback.find_one({"_id": "S1-s1"}))
+        self.assertEqual(1, core.db.db.feedback.find().count())
+
+    def test_flush(self):
+        for i in range(5):
+            self.add_session("S1-s%d" % i)
+        core.feedback.flush_sessions()
+        self.assertEqual(5, core.db.db.feedback.find().count())
+        self.assertFalse(core.feedback._sessions)
+        self.assertFalse(core.feedback._flushing)
+
+    def test_flush_size(self):
+        core.config.config["SESSION_FLUSH_SIZE"] = 3
+        for i in range(3):
+            self.add_session("S1-s%d" % i)
+        self.assertEqual(3, core.db.db.feedback.find().count())
+
+    def test_feedback_while_flushing(self):
+        found = []
+
+        def before_insert(sessions):
+            # Another thread that gets feedback while the sessions are
+            # written still finds them
+            found.append(core.feedback._get_session("S1", "S1-s1"))
+            self.add_feedback("S1-s1")
+
+        self.add_session("S1-s1")
+        self.add_session("S1-s2")
+        core.feedback.db = FeedbackDatabase(before_insert)
+        core.feedback.flush_sessions()
+        self.assertEqual("S1-s1", found[0]["_id"])
+        self.assertIn("doclist",
+                      core.db.db.feedback.find_one({"_id": "S1-s1"}))
+        self.assertEqual(2, core.db.db.feedback.find().count())
+        self.assertFalse(core.feedback._flushing)
+
+    def test_requeue(self):
+        def before_insert(sessions):
+            raise AutoReconnect("down")
+
+        self.add_session("S1-s1")
+        core.feedback.db = FeedbackDatabase(before_insert)
+        self.assertRaises(AutoReconnect, core.feedback.flush_sessions)
+        # The session is back in the buffer, and feedback still finds it
+        self.assertIn("S1-s1", core.feedback._sessions)
+        self.assertFalse(core.feedback._flushing)
+        core.feedback.db = core.db.db
+        self.add_feedback("S1-s1")
+        core.feedback.flush_sessions()
+        self.assertIn("doclist",
+                      core.db.db.feedback.find_one({"_id": "S1-s1"}))
+
+    def test_concurrent_feedback(self):
+        self.add_session("S1-s1")
+        core.feedback.flush_sessions()
+        start = threading.Event()
+
+        def add_feedback():
+            start.wait()
+            self.add_feedback("S1-s1")
+
+        threads = [threading.Thread(target=add_feedback) for _ in range(10)]
+        for t in threads:
+            t.start()
+        start.set()
+        for t in threads:
+            t.join()
+        # The session is counted once, for its query and for all queries
+        rows = list(core.db.db.outcome.find())
+        self.assertEqual(2, len(rows))
+        for row in rows:
+            self.assertEqual((1, 1, 0, 0),
+                             tuple(row.get(field, 0)
+                                   for field in ["impressions", "wins",
+                                                 "losses", "ties"]))
+
+    def test_unknown_session(self):
+        self.assertRaises(LookupError, self.add_feedback, "S1-s1")
+
+
+class TestQtype(MongoTestCase):
+
+    def setUp(self):
+        super(TestQtype, self).setUp()
+        for i, query_type in enumerate([None, "test"]):
+            core.db.db.query.insert({"_id": "S1-q%d" % i, "site_id": "S1",
+                                     "site_qid": "q%d" % i,
+                                     "type": query_type})
+            # Sessions from before get_ranking stored the query type
+            core.db.db.feedback.insert({"_id": "S1-s%d" % i, "site_id": "S1",
+                                        "qid": "S1-q%d" % i, "userid": "P1",
+                                        "doclist": []})
+
+    def test_set_qtypes(self):
+        self.assertEqual([], list(core.feedback.get_feedback(userid="P1")))
+        self.assertEqual(2, core.feedback.set_qtypes())
+        self.assertEqual(["S1-s0"], [f["_id"] for f in
+                                     core.feedback.get_feedback(userid="P1")])
+        self.assertEqual(["S1-s1"], [f["_id"] for f in
+                                     core.feedback.get_test_feedback(
+                                         userid="P1", qtype="test")])
+        # Nothing left to do on the next start
+        self.assertEqual(0, core.feedback.set_qtypes())
+
+    def test_invalid_since(self):
+        self.assertRaises(Exception, core.feedback.get_feedback,
+                          userid="P1", since="yesterday")
+
+
+class TestSinceCursor(MongoTestCase):
+
+    def setUp(self):
+        super(TestSinceCursor, self).setUp()
+        self.delay = core.config.config["FEEDBACK_CURSOR_DELAY_SECONDS"]
+        core.config.config["FEEDBACK_CURSOR_DELAY_SECONDS"] = 5
+
+    def tearDown(self):
+        core.config.config["FEEDBACK_CURSOR_DELAY_SECONDS"] = self.delay
+
+    def add(self, sid, cursor, runid="r1"):
+        # Feedback modified at the time of cursor
+        core.db.db.feedback.insert({"_id": sid, "site_id": "S1",
+                                    "qid": "S1-q1", "qtype": "train",
+                                    "userid": "P1", "runid": runid,
+                                    "doclist": [],
+                                    "modified_time":
+                                        core.feedback._cursor_time(cursor)})
+
+    def sids(self, **kwargs):
+        return sorted(f["_id"] for f in
+                      core.feedback.get_feedback(userid="P1", **kwargs))
+
+    def test_cursor(self):
+        before = datetime.datetime.now()
+        cursor = core.feedback.get_feedback_cursor()
+        # The cursor lags the delay behind, in milliseconds
+        lag = before - core.feedback._cursor_time(cursor)
+        self.assertTrue(datetime.timedelta(seconds=4.9) < lag <
+                        datetime.timedelta(seconds=5.1))
+        self.assertRaises(Exception, core.feedback._cursor_time, "x")
+
+    def test_boundaries(self):
+        since = int(core.feedback.get_feedback_cursor()) - 10000
+        until = since + 5000
+        self.add("S1-s1", str(since))
+        self.add("S1-s2", str(since + 1))
+        self.add("S1-s3", str(until))
+        self.add("S1-s4", str(until + 1))
+        # Feedback at the since cursor was returned by the previous poll,
+        # feedback at the until cursor by this one
+        self.assertEqual(["S1-s2", "S1-s3"],
+                         self.sids(since=str(since), until=str(until)))
+        self.assertEqual(["S1-s4"], self.sids(since=str(until)))
+        self.assertEqual(["S1-s1", "S1-s2", "S1-s3", "S1-s4"], self.sids())
+
+    def test_delay(self):
+        cursor = core.feedback.get_feedback_cursor()
+        since = str(int(cursor) - 1000)
+        # Written by another process a moment ago, after the cursor
+        self.add("S1-s1", str(int(cursor) + 2000))
+        self.assertEqual([], self.sids(since=since, until=cursor))
+        # The next poll, once the delay has passed, picks it up
+        self.assertEqual(["S1-s1"],
+                         self.sids(since=cursor,
+                                   until=str(int(cursor) + 5000)))
+
+    def test_runid(self):
+        cursor = core.feedback.get_feedback_cursor()
+        since = str(int(cursor) - 1000)
+        self.add("S1-s1", cursor, runid="r1")
+        self.add("S1-s2", cursor, runid="r2")
+        self.assertEqual(["S1-s2"],
+                         self.sids(runid="r2", since=since, until=cursor))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+# This file is part of Living Labs Challenge, see http://living-labs.net.
+#
+# Living Labs Challenge is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Living Labs Challenge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Living Labs Challenge. If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+
+from mongodb import MongoTestCase, core
+
+
+class TestIndexes(MongoTestCase):
+
+    def test_ensure_indexes(self):
+        created = core.db.ensure_indexes()
+        self.assertEqual(sum(len(i) for i in core.db.INDEXES.values()),
+                         len(created))
+        self.assertEqual([], core.db.ensure_indexes())
+        report = core.db.get_index_report()
+        for collection in core.db.INDEXES:
+            self.assertEqual([], report[collection]["missing"])
+            self.assertEqual([], report[collection]["unregistered"])
+
+    def test_report_missing(self):
+        report = core.db.get_index_report()
+        self.assertEqual(core.db.INDEXES["feedback"],
+                         report["feedback"]["missing"])
+
+    def index_keys(self, plan):
+        # The keys of the indexes a query plan scans
+        if plan.get("stage") == "IXSCAN":
+            return [sorted(plan["keyPattern"])]
+        stages = plan.get("inputStages", []) + \
+            ([plan["inputStage"]] if "inputStage" in plan else [])
+        return sum((self.index_keys(stage) for stage in stages), [])
+
+    def test_feedback_query(self):
+        core.db.ensure_indexes()
+        core.db.db.feedback.insert({"_id": "S1-s1", "site_id": "S1",
+                                    "userid": "P1", "qid": "S1-q1",
+                                    "qtype": "train", "doclist": []})
+        feedback = core.feedback.get_feedback(userid="P1", site_id="S1",
+                                              qid="S1-q1")
+        self.assertEqual(["S1-s1"], [f["_id"] for f in feedback])
+        # The planner is free to use an index with the query type
+        plan = core.feedback.get_feedback(userid="P1", site_id="S1").explain()
+        keys = self.index_keys(plan["queryPlanner"]["winningPlan"])
+        self.assertTrue(keys)
+        for k in keys:
+            self.assertIn("qtype", k)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+# This file is part of Living Labs Challenge, see http://living-labs.net.
+#
+# Living Labs Challenge is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Living Labs Challenge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Living Labs Challenge. If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+import time
+import unittest
+
+from mongodb import MongoTestCase, core
+
+
+class TestJobs(MongoTestCase):
+
+    def test_lease(self):
+        self.assertTrue(core.jobs.acquire_lease("test", "w1", 60))
+        self.assertFalse(core.jobs.acquire_lease("test", "w2", 60))
+        # Renewing is fine
+        self.assertTrue(core.jobs.acquire_lease("test", "w1", 60))
+        core.jobs.release_lease("test", "w2")
+        self.assertFalse(core.jobs.acquire_lease("test", "w2", 60))
+        core.jobs.release_lease("test", "w1")
+        self.assertTrue(core.jobs.acquire_lease("test", "w2", 60))
+
+    def test_expired_lease(self):
+        self.assertTrue(core.jobs.acquire_lease("test", "w1", -1))
+        self.assertTrue(core.jobs.acquire_lease("test", "w2", 60))
+        self.assertFalse(core.jobs.acquire_lease("test", "w1", 60))
+
+    def test_run_job(self):
+        report = core.jobs.run_job("test", lambda: 3, "w1")
+        self.assertEqual(3, report["rows"])
+        stored = core.db.db.job.find_one({"_id": "test"})
+        self.assertEqual(("w1", 3), (stored["owner"], stored["rows"]))
+        self.assertIsNone(core.jobs.run_job("test", lambda: 3, "w2"))
+
+    def test_run_job_renews_lease(self):
+        lease_seconds = core.config.config["WORKER_LEASE_SECONDS"]
+        core.config.config["WORKER_LEASE_SECONDS"] = 1
+        taken = []
+
+        def job():
+            # Outlives the lease it started with
+            time.sleep(2.5)
+            taken.append(core.jobs.acquire_lease(core.jobs.WORKER_LEASE,
+                                                 "w2", 1))
+            return 0
+
+        try:
+            core.jobs.run_job("test", job, "w1")
+        finally:
+            core.config.config["WORKER_LEASE_SECONDS"] = lease_seconds
+        self.assertEqual([False], taken)
+
+
+class TestCleanup(MongoTestCase):
+
+    def setUp(self):
+        super(TestCleanup, self).setUp()
+        self.send_email = core.config.config["SEND_EMAIL"]
+        core.config.config["SEND_EMAIL"] = False
+        now = datetime.datetime.now()
+        day = datetime.timedelta(days=1)
+        core.db.db.user.insert({"_id": "P1", "teamname": "P1",
+                                "email": "p1@example.org"})
+        # qid: (current run, its age in days, doclist age in days)
+        for i, (runid, age, doclist_age) in enumerate([("deletable", 40, None),
+                                                       ("outdated", 33, None),
+                                                       ("doclist", 1, 0),
+                                                       ("current", 1, None)]):
+            qid = "S1-q%d" % i
+            query = {"_id": qid, "site_id": "S1", "site_qid": str(i),
+                     "runs": {"P1": [runid, now - age * day]}}
+            if doclist_age is not None:
+                query["doclist_modified_time"] = now - doclist_age * day
+            core.db.db.query.insert(query)
+            core.db.db.run.insert({"runid": runid, "qid": qid,
+                                   "site_id": "S1", "site_qid": str(i),
+                                   "userid": "P1", "doclist": [],
+                                   "creation_time": now - age * day})
+        # A run that was replaced by a newer one
+        core.db.db.run.insert({"runid": "replaced", "qid": "S1-q3",
+                               "site_id": "S1", "site_qid": "3",
+                               "userid": "P1", "doclist": [],
+                               "creation_time": now - 50 * day})
+        # Queries used to carry their active runs
+        self.assertEqual(4, core.run.migrate_active_runs())
+
+    def tearDown(self):
+        core.config.config["SEND_EMAIL"] = self.send_email
+
+    def runids(self, runs):
+        return [sorted(r["runid"] for r in l) for l in runs]
+
+    def test_migrate_active_runs(self):
+        self.assertEqual(0, core.db.db.query.find(
+            {"runs": {"$exists": True}}).count())
+        self.assertEqual(0, core.run.migrate_active_runs())
+        self.assertEqual(("S1-q0", "deletable"),
+                         core.run.get_run_version("P1", "S1-q0")[0][:2])
+
+    def test_old_runs(self):
+        self.assertEqual([["deletable"], []],
+                         self.runids(core.run.get_deletable_runs()))
+        self.assertEqual([["deletable", "outdated"], ["doclist"]],
+                         self.runids(core.run.get_outdated_runs()))
+        self.assertEqual([[], []],
+                         self.runids(core.run.get_outdated_runs("P2")))
+
+    def test_old_runs_candidates(self):
+        emitted = []
+        core.metrics.set_sink(lambda kind, name, value:
+                              emitted.append((name, value)))
+        try:
+            core.run.get_outdated_runs()
+        finally:
+            core.metrics.set_sink(None)
+        # The current run of a query without a new doclist is not looked at
+        self.assertIn(("cleanup.runs_examined", 3), emitted)
+
+    def test_cleanup(self):
+        self.assertEqual(3, core.jobs.db_cleanup())
+        runs = dict((a["qid"], a["runid"])
+                    for a in core.run.get_active_runs(key="P1"))
+        self.assertEqual({"S1-q1": "outdated", "S1-q2": "doclist",
+                          "S1-q3": "current"}, runs)
+        notified = core.db.db.run.find(
+            {"notification_sent_time": {"$exists": True}})
+        self.assertEqual(["doclist", "outdated"],
+                         sorted(r["runid"] for r in notified))
+        # Nothing left to delete, and no new notifications
+        self.assertEqual(2, core.jobs.db_cleanup())
+
+    def test_metrics(self):
+        emitted = []
+        core.metrics.set_sink(lambda kind, name, value:
+                              emitted.append((kind, name, value)))
+        try:
+            core.jobs.run_job("cleanup", core.jobs.db_cleanup, "w1")
+        finally:
+            core.metrics.set_sink(None)
+        counters = dict((name, value) for kind, name, value in emitted
+                        if kind == "counter")
+        self.assertEqual(1, counters["cleanup.runs_deleted"])
+        self.assertEqual(3, counters["job.cleanup.rows"])
+        self.assertIn("job.cleanup.seconds",
+                      [name for kind, name, value in emitted
+                       if kind == "timing"])
+
+
+if __name__ == '__main__':
+    unittest.main()
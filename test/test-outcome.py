@@ -0,0 +1,157 @@
+# This file is part of Living Labs Challenge, see http://living-labs.net.
+#
+# Living Labs Challenge is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Living Labs Challenge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Living Labs Challenge. If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+import random
+import unittest
+
+from mongodb import MongoTestCase, core
+
+PARTICIPANTS = ["P1", "P2"]
+SITES = ["S1", "S2"]
+N_SESSIONS = 500
+
+
+class TestOutcome(MongoTestCase):
+
+    def setUp(self):
+        super(TestOutcome, self).setUp()
+        rnd = random.Random(42)
+        now = datetime.datetime.now()
+        day = datetime.timedelta(days=1)
+        self.test_periods = core.config.config["TEST_PERIODS"]
+        # Two finished, overlapping periods and one that is still running
+        core.config.config["TEST_PERIODS"] = [
+            {"NAME": "first", "START": now - 30 * day, "END": now - 10 * day},
+            {"NAME": "second", "START": now - 20 * day, "END": now - 5 * day},
+            {"NAME": "running", "START": now - 2 * day, "END": now + day},
+        ]
+
+        for site_id in SITES:
+            for i in range(10):
+                qtype = "test" if i % 2 else "train"
+                core.db.db.query.insert({"_id": "%s-q%d" % (site_id, i),
+                                         "site_id": site_id,
+                                         "site_qid": str(i),
+                                         "type": qtype,
+                                         "deleted": i == 9})
+        core.db.db.user.insert({"_id": "P1", "signed_up_for": SITES})
+
+        for sid in range(N_SESSIONS):
+            site_id = rnd.choice(SITES)
+            doclist = []
+            for rank in range(5):
+                d = {"docid": "%s-d%d" % (site_id, rank),
+                     "team": rnd.choice(["participant", "site", None])}
+                clicked = rnd.choice([True, False, [], [now], None, 1])
+                if clicked is not None:
+                    d["clicked"] = clicked
+                doclist.append(d)
+            feedback = {"_id": "%s-s%d" % (site_id, sid),
+                        "site_id": site_id,
+                        "userid": rnd.choice(PARTICIPANTS),
+                        "qid": "%s-q%d" % (site_id, rnd.randint(0, 10)),
+                        "creation_time": now - rnd.randint(0, 40) * day,
+                        }
+            # Sessions that never got feedback have no doclist
+            if rnd.random() < 0.9:
+                feedback["doclist"] = doclist
+            core.db.db.feedback.insert(feedback)
+        core.feedback.set_qtypes()
+
+    def tearDown(self):
+        core.config.config["TEST_PERIODS"] = self.test_periods
+
+    def assertSameComparison(self, **kwargs):
+        expected = core.feedback.get_comparison(pipeline=False, **kwargs)
+        actual = core.feedback.get_comparison(pipeline=True, **kwargs)
+        self.assertEqual(expected, actual)
+        return actual
+
+    def test_comparison(self):
+        for userid in PARTICIPANTS:
+            for site_id in SITES:
+                for qtype in [None, "test", "train"]:
+                    outcomes = self.assertSameComparison(userid=userid,
+                                                         site_id=site_id,
+                                                         qtype=qtype)
+                    self.assertTrue(outcomes)
+
+    def test_comparison_qid(self):
+        for qid in ["S1-q1", "S1-q2", "S1-q9", "S1-q10"]:
+            self.assertSameComparison(userid="P1", site_id="S1", qid=qid)
+            self.assertSameComparison(userid="P1", site_id="S1", qid=qid,
+                                      qtype="test")
+
+    def test_comparison_signed_up_sites(self):
+        outcomes = self.assertSameComparison(userid="P1")
+        self.assertEqual(set(SITES), set(o["site_id"] for o in outcomes))
+
+    def test_rebuild_outcomes(self):
+        core.feedback.rebuild_outcomes()
+        for qid in [None, "S1-q1", "S1-q2", "S1-q9"]:
+            self.assertEqual(core.feedback.get_comparison("P1", qid=qid),
+                             core.feedback.get_outcomes("P1", qid=qid))
+
+    def test_add_feedback_updates_outcomes(self):
+        core.feedback.rebuild_outcomes()
+        rnd = random.Random(7)
+        for site_id in SITES:
+            for rank in range(5):
+                core.db.db.doc.insert({"_id": "%s-d%d" % (site_id, rank),
+                                       "site_id": site_id,
+                                       "site_docid": "d%d" % rank})
+        sessions = [f for f in core.db.db.feedback.find({"userid": "P1"})]
+        for f in rnd.sample(sessions, 100):
+            # Sites send feedback for a session again as clicks come in
+            for _ in range(rnd.randint(1, 3)):
+                doclist = [{"site_docid": "d%d" % rank,
+                            "team": rnd.choice(["participant", "site"]),
+                            "clicked": rnd.random() < 0.3}
+                           for rank in range(5)]
+                core.feedback.add_feedback(f["site_id"], f["_id"],
+                                           {"doclist": doclist})
+        for qid in [None, "S1-q1", "S1-q2", "S2-q3"]:
+            self.assertEqual(core.feedback.get_comparison("P1", qid=qid),
+                             core.feedback.get_outcomes("P1", qid=qid))
+
+    def test_reset_feedback_updates_outcomes(self):
+        core.feedback.rebuild_outcomes()
+        core.feedback.reset_feedback(userid="P1", qid="S1-q1")
+        core.feedback.reset_feedback(userid="P1", site_id="S2")
+        self.assertFalse(core.db.db.feedback.find({"userid": "P1",
+                                                   "site_id": "S2"}).count())
+        for qid in [None, "S1-q1", "S1-q2", "S2-q3"]:
+            self.assertEqual(core.feedback.get_comparison("P1", qid=qid),
+                             core.feedback.get_outcomes("P1", qid=qid))
+
+    def test_delete_query_updates_outcomes(self):
+        core.feedback.rebuild_outcomes()
+        self.assertTrue(core.db.db.outcome.find({"qid": "S1-q2"}).count())
+        self.assertTrue(core.query.delete_query("S1", "S1-q2"))
+        self.assertFalse(core.db.db.outcome.find({"qid": "S1-q2"}).count())
+        for qid in [None, "S1-q1", "S1-q2"]:
+            self.assertEqual(core.feedback.get_comparison("P1", qid=qid),
+                             core.feedback.get_outcomes("P1", qid=qid))
+
+    def test_running_period_is_skipped(self):
+        outcomes = core.feedback.get_comparison(userid="P1", site_id="S1",
+                                                qtype="test")
+        self.assertEqual(["first", "second"],
+                         [o["test_period"]["NAME"] for o in outcomes])
+
+
+if __name__ == '__main__':
+    unittest.main()
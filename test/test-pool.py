@@ -0,0 +1,95 @@
+# This file is part of Living Labs Challenge, see http://living-labs.net.
+#
+# Living Labs Challenge is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Living Labs Challenge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Living Labs Challenge. If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+import unittest
+
+from mongodb import MongoTestCase, core
+
+
+class TestPool(MongoTestCase):
+
+    def setUp(self):
+        super(TestPool, self).setUp()
+        self.test_periods = core.config.config["TEST_PERIODS"]
+        core.config.config["TEST_PERIODS"] = []
+        core.pool.invalidate()
+        core.db.db.site.insert({"_id": "S1", "sid_counter": 0})
+        for userid in ["P1", "P2"]:
+            core.db.db.user.insert({"_id": userid, "signed_up_for": ["S1"]})
+        core.db.db.doc.insert({"_id": "S1-d1", "site_id": "S1",
+                               "site_docid": "d1"})
+        core.db.db.query.insert({"_id": "S1-q1", "site_id": "S1",
+                                 "site_qid": "q1", "type": "train"})
+
+    def tearDown(self):
+        core.config.config["TEST_PERIODS"] = self.test_periods
+        core.pool.invalidate()
+        core.scheduler.flush()
+        core.feedback.flush_sessions()
+        core.stats.flush_stats()
+
+    def add_run(self, userid, runid):
+        core.run.add_run(userid, "S1-q1", runid, [{"docid": "S1-d1"}])
+
+    def test_ranking(self):
+        self.add_run("P1", "r1")
+        ranking = core.run.get_ranking("S1", "q1")
+        self.assertEqual(("P1", "r1", "S1-q1"),
+                         (ranking["userid"], ranking["runid"],
+                          ranking["qid"]))
+        self.assertEqual(["S1-d1"], [d["docid"] for d in ranking["doclist"]])
+        self.assertIn("sid", ranking)
+
+    def test_new_run(self):
+        self.add_run("P1", "r1")
+        core.run.get_ranking("S1", "q1")
+        # Uploading a run drops the entry of its query in this process
+        self.add_run("P1", "r2")
+        self.assertEqual("r2", core.run.get_ranking("S1", "q1")["runid"])
+
+    def test_expires(self):
+        self.add_run("P1", "r1")
+        core.pool.get("S1", "q1")
+        # Another process uploads a run, this one only sees it once the
+        # entry expired
+        core.db.db.run.insert({"userid": "P2", "qid": "S1-q1",
+                               "site_id": "S1", "site_qid": "q1",
+                               "runid": "r9",
+                               "doclist": [{"docid": "S1-d1"}],
+                               "creation_time": datetime.datetime.now()})
+        core.db.db.active_run.insert({"_id": "S1-q1/P2", "qid": "S1-q1",
+                                      "userid": "P2", "site_id": "S1",
+                                      "site_qid": "q1", "runid": "r9",
+                                      "creation_time":
+                                          datetime.datetime.now()})
+        self.assertEqual(["P1"], core.pool.get("S1", "q1")["runs"].keys())
+        core.pool._entries[("S1", "q1")]["expires"] = 0
+        self.assertEqual(["P1", "P2"],
+                         sorted(core.pool.get("S1", "q1")["runs"]))
+
+    def test_no_runs(self):
+        self.assertRaises(LookupError, core.run.get_ranking, "S1", "q1")
+        self.add_run("P1", "r1")
+        core.run.get_ranking("S1", "q1")
+        core.run.remove_runs_user("P1")
+        self.assertRaises(LookupError, core.run.get_ranking, "S1", "q1")
+
+    def test_unknown_query(self):
+        self.assertRaises(LookupError, core.run.get_ranking, "S1", "q9")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+# This file is part of Living Labs Challenge, see http://living-labs.net.
+#
+# Living Labs Challenge is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Living Labs Challenge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Living Labs Challenge. If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+import json
+import unittest
+
+from mongodb import MongoTestCase, core
+from ll.api import app
+import ll.api.participant
+
+URL = "/api/participant/query/P1"
+
+
+class TestQueryVersion(MongoTestCase):
+
+    def setUp(self):
+        super(TestQueryVersion, self).setUp()
+        app.debug = True
+        self.client = app.test_client()
+        core.db.db.user.insert({"_id": "P1", "is_participant": True,
+                                "is_verified": True, "is_site": False,
+                                "signed_up_for": ["S1"]})
+        core.db.db.site.insert({"_id": "S1", "qid_counter": 0,
+                                "docid_counter": 0})
+        core.db.db.doc.insert({"_id": "S1-d1", "site_id": "S1",
+                               "site_docid": "d1"})
+        for site_qid in ["q1", "q2", "q3"]:
+            core.query.add_query("S1", site_qid, site_qid, "train",
+                                 qid="S1-%s" % site_qid)
+        for site_qid in ["q1", "q2"]:
+            core.doc.add_doclist("S1", site_qid, [{"site_docid": "d1"}])
+
+    def tearDown(self):
+        core.stats.flush_stats()
+
+    def get(self, etag=None):
+        headers = {"If-None-Match": etag} if etag else {}
+        return self.client.get(URL, headers=headers)
+
+    def assertChanged(self, change):
+        etag = self.get().headers["ETag"]
+        self.assertEqual(304, self.get(etag).status_code)
+        change()
+        r = self.get(etag)
+        self.assertEqual(200, r.status_code)
+        self.assertNotEqual(etag, r.headers["ETag"])
+        return r
+
+    def test_not_modified(self):
+        r = self.get()
+        self.assertEqual(200, r.status_code)
+        self.assertIn("ETag", r.headers)
+        self.assertIn("Last-Modified", r.headers)
+        self.assertEqual(304, self.get(r.headers["ETag"]).status_code)
+        self.assertEqual(200, self.get('W/"other"').status_code)
+        r = self.client.get(URL, headers={
+            "If-Modified-Since": r.headers["Last-Modified"]})
+        self.assertEqual(304, r.status_code)
+
+    def test_new_query(self):
+        self.assertChanged(lambda: core.doc.add_doclist(
+            "S1", "q3", [{"site_docid": "d1"}]))
+
+    def test_replaced_doclist(self):
+        self.assertChanged(lambda: core.doc.add_doclist(
+            "S1", "q1", [{"site_docid": "d1"}]))
+
+    def test_deleted_query(self):
+        self.assertChanged(lambda: core.query.delete_query("S1", "S1-q1"))
+
+    def test_query_replaced_by_another(self):
+        def change():
+            # As many queries with a doclist as before, and no query is
+            # newer than before
+            core.query.delete_query("S1", "S1-q1")
+            core.db.db.query.update_one(
+                {"_id": "S1-q3"},
+                {"$set": {"doclist": ["S1-d1"],
+                          "creation_time": datetime.datetime(2000, 1, 1)}})
+
+        r = self.assertChanged(change)
+        self.assertEqual(["S1-q2", "S1-q3"],
+                         sorted(q["qid"] for q in
+                                json.loads(r.data)["queries"]))
+
+    def test_updated_query(self):
+        self.assertChanged(lambda: core.query.add_query("S1", "q1", "new",
+                                                        "train"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,206 @@
+# This file is part of Living Labs Challenge, see http://living-labs.net.
+#
+# Living Labs Challenge is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Living Labs Challenge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Living Labs Challenge. If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+import threading
+import unittest
+
+from mongodb import MongoTestCase, core
+
+N_THREADS = 20
+N_RUNIDS = 3
+
+
+class TestAddRun(MongoTestCase):
+
+    def setUp(self):
+        super(TestAddRun, self).setUp()
+        self.test_periods = core.config.config["TEST_PERIODS"]
+        core.db.ensure_indexes()
+        core.db.db.user.insert({"_id": "P1", "signed_up_for": ["S1"]})
+        for i in range(5):
+            core.db.db.doc.insert({"_id": "S1-d%d" % i, "site_id": "S1",
+                                   "site_docid": "d%d" % i})
+        core.db.db.query.insert({"_id": "S1-q1", "site_id": "S1",
+                                 "site_qid": "q1", "type": "test"})
+
+    def tearDown(self):
+        core.config.config["TEST_PERIODS"] = self.test_periods
+        core.stats.flush_stats()
+
+    def upload(self, runids):
+        """Uploads a run for every runid at the same time."""
+        start = threading.Event()
+        errors = []
+
+        def upload(runid):
+            doclist = [{"docid": "S1-d%d" % i} for i in range(5)]
+            start.wait()
+            try:
+                core.run.add_run("P1", "S1-q1", runid, doclist)
+            except ValueError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=upload, args=(runid,))
+                   for runid in runids]
+        for t in threads:
+            t.start()
+        start.set()
+        for t in threads:
+            t.join()
+        return errors
+
+    def test_parallel_uploads(self):
+        core.config.config["TEST_PERIODS"] = []
+        runids = ["r%d" % (i % N_RUNIDS) for i in range(N_THREADS)]
+        self.assertEqual([], self.upload(runids))
+        # One run per runid, and the active run is one of them
+        self.assertEqual(N_RUNIDS, core.db.db.run.find().count())
+        run = core.run.get_run("P1", "S1-q1")
+        self.assertIn(run["runid"], runids)
+        self.assertEqual(5, len(run["doclist"]))
+        core.stats.flush_stats()
+        self.assertEqual(N_RUNIDS, core.db.db.stats.find_one(
+            {"_id": core.stats.participant_stats_id("P1")})["run"])
+
+    def test_parallel_uploads_test_period(self):
+        now = datetime.datetime.now()
+        core.config.config["TEST_PERIODS"] = [
+            {"NAME": "now", "START": now - datetime.timedelta(days=1),
+             "END": now + datetime.timedelta(days=1)}]
+        runids = ["r%d" % i for i in range(N_THREADS)]
+        errors = self.upload(runids)
+        # Only one upload is allowed during a test period
+        self.assertEqual(N_THREADS - 1, len(errors))
+        self.assertEqual(1, core.db.db.run.find().count())
+        self.assertEqual(core.db.db.run.find_one()["runid"],
+                         core.run.get_run("P1", "S1-q1")["runid"])
+
+    def test_parallel_uploads_same_runid(self):
+        now = datetime.datetime.now()
+        core.config.config["TEST_PERIODS"] = [
+            {"NAME": "now", "START": now - datetime.timedelta(days=1),
+             "END": now + datetime.timedelta(days=1)}]
+        # An earlier upload of the runid, without an active run
+        core.db.db.run.insert({"userid": "P1", "qid": "S1-q1",
+                               "site_qid": "q1", "site_id": "S1",
+                               "runid": "r1", "creation_time": now,
+                               "doclist": [{"docid": "S1-d0"}]})
+        start = threading.Event()
+        accepted = []
+
+        def upload(i):
+            doclist = [{"docid": "S1-d%d" % i}]
+            start.wait()
+            try:
+                core.run.add_run("P1", "S1-q1", "r1", doclist)
+                accepted.append([d["docid"] for d in doclist])
+            except ValueError:
+                pass
+
+        threads = [threading.Thread(target=upload, args=(i,))
+                   for i in range(5)]
+        for t in threads:
+            t.start()
+        start.set()
+        for t in threads:
+            t.join()
+        # Refused uploads leave the run of the accepted one intact
+        self.assertEqual(1, len(accepted))
+        self.assertEqual(accepted[0],
+                         [d["docid"] for d in
+                          core.run.get_run("P1", "S1-q1")["doclist"]])
+
+    def test_add_runs(self):
+        core.config.config["TEST_PERIODS"] = []
+        core.db.db.query.insert({"_id": "S1-q2", "site_id": "S1",
+                                 "site_qid": "q2"})
+        runs = [{"qid": "S1-q1", "runid": "r1",
+                 "doclist": [{"docid": "S1-d%d" % i} for i in range(5)]},
+                {"qid": "S1-q2", "runid": "r1",
+                 "doclist": [{"docid": "S1-d1"}, {"docid": "S1-d9"}]},
+                {"qid": "S1-q3", "runid": "r1",
+                 "doclist": [{"docid": "S1-d1"}]}]
+        errors = [error for _, error in core.run.add_runs("P1", runs)]
+        self.assertIsNone(errors[0])
+        self.assertIsInstance(errors[1], LookupError)
+        self.assertIsInstance(errors[2], LookupError)
+        self.assertEqual(1, core.db.db.run.find().count())
+        self.assertEqual("r1", core.run.get_run("P1", "S1-q1")["runid"])
+        self.assertRaises(LookupError, core.run.get_run, "P1", "S1-q2")
+
+    def test_add_runs_missing_fields(self):
+        core.config.config["TEST_PERIODS"] = []
+        doclist = [{"docid": "S1-d1"}]
+        runs = [{"qid": "S1-q1", "doclist": doclist},
+                {"qid": "S1-q1", "runid": "r1",
+                 "doclist": [{"site_docid": "d1"}]},
+                "S1-q1",
+                {"qid": "S1-q1", "runid": "r1", "doclist": doclist}]
+        errors = [error for _, error in core.run.add_runs("P1", runs)]
+        self.assertEqual(3, len([e for e in errors[:3]
+                                 if type(e) is Exception]))
+        # The only complete run is stored, the others do not count as a
+        # second run for the query
+        self.assertIsNone(errors[3])
+        self.assertEqual("r1", core.run.get_run("P1", "S1-q1")["runid"])
+
+    def test_add_runs_test_period(self):
+        now = datetime.datetime.now()
+        core.config.config["TEST_PERIODS"] = [
+            {"NAME": "now", "START": now - datetime.timedelta(days=1),
+             "END": now + datetime.timedelta(days=1)}]
+        run = {"qid": "S1-q1", "runid": "r1",
+               "doclist": [{"docid": "S1-d1"}]}
+        self.assertIsNone(core.run.add_runs("P1", [dict(run)])[0][1])
+        run["runid"] = "r2"
+        _, error = core.run.add_runs("P1", [dict(run)])[0]
+        self.assertIsInstance(error, ValueError)
+        self.assertEqual("r1", core.run.get_run("P1", "S1-q1")["runid"])
+        self.assertEqual(1, core.db.db.run.find().count())
+
+    def test_parallel_add_runs_same_runid(self):
+        now = datetime.datetime.now()
+        core.config.config["TEST_PERIODS"] = [
+            {"NAME": "now", "START": now - datetime.timedelta(days=1),
+             "END": now + datetime.timedelta(days=1)}]
+        core.db.db.run.insert({"userid": "P1", "qid": "S1-q1",
+                               "site_qid": "q1", "site_id": "S1",
+                               "runid": "r1", "creation_time": now,
+                               "doclist": [{"docid": "S1-d0"}]})
+        start = threading.Event()
+        accepted = []
+
+        def upload(i):
+            run = {"qid": "S1-q1", "runid": "r1",
+                   "doclist": [{"docid": "S1-d%d" % i}]}
+            start.wait()
+            if core.run.add_runs("P1", [run])[0][1] is None:
+                accepted.append(["S1-d%d" % i])
+
+        threads = [threading.Thread(target=upload, args=(i,))
+                   for i in range(5)]
+        for t in threads:
+            t.start()
+        start.set()
+        for t in threads:
+            t.join()
+        self.assertEqual(1, len(accepted))
+        self.assertEqual(accepted[0],
+                         [d["docid"] for d in
+                          core.run.get_run("P1", "S1-q1")["doclist"]])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+# This file is part of Living Labs Challenge, see http://living-labs.net.
+#
+# Living Labs Challenge is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Living Labs Challenge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Living Labs Challenge. If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+from collections import Counter
+
+from mongodb import MongoTestCase, core
+
+PARTICIPANTS = ["P%d" % i for i in range(5)]
+
+
+class TestScheduler(MongoTestCase):
+
+    def setUp(self):
+        super(TestScheduler, self).setUp()
+        self.flush_size = core.config.config["SCHEDULE_FLUSH_SIZE"]
+
+    def tearDown(self):
+        core.config.config["SCHEDULE_FLUSH_SIZE"] = self.flush_size
+        core.scheduler.flush()
+
+    def serve(self, heap, n):
+        return Counter(core.scheduler.next("S1-q1", heap) for _ in range(n))
+
+    def test_fair(self):
+        heap = core.scheduler.schedule("S1-q1", PARTICIPANTS)
+        served = self.serve(heap, 103)
+        self.assertEqual(set(PARTICIPANTS), set(served))
+        self.assertLessEqual(max(served.values()) - min(served.values()), 1)
+
+    def test_least_served_first(self):
+        core.db.db.schedule.insert([
+            {"_id": "S1-q1/%s" % userid, "qid": "S1-q1", "userid": userid,
+             "impressions": 10 * i} for i, userid in enumerate(PARTICIPANTS)])
+        heap = core.scheduler.schedule("S1-q1", PARTICIPANTS)
+        # P0 catches up with P1 before P1 is shown
+        self.assertEqual({"P0": 10}, self.serve(heap, 10))
+        self.assertEqual(set(["P0", "P1"]), set(self.serve(heap, 20)))
+
+    def test_new_participant(self):
+        heap = core.scheduler.schedule("S1-q1", PARTICIPANTS[:2])
+        self.serve(heap, 10)
+        # A participant that joins is not shown more than the others ever
+        # were, nor starved
+        heap = core.scheduler.schedule("S1-q1", PARTICIPANTS[:3])
+        self.assertEqual({"P2": 5}, self.serve(heap, 5))
+        served = self.serve(heap, 30)
+        self.assertEqual({"P0": 10, "P1": 10, "P2": 10}, served)
+
+    def test_flush(self):
+        core.config.config["SCHEDULE_FLUSH_SIZE"] = 1000
+        heap = core.scheduler.schedule("S1-q1", PARTICIPANTS)
+        self.serve(heap, 10)
+        self.assertEqual(0, core.db.db.schedule.find().count())
+        core.scheduler.flush()
+        stored = dict((s["userid"], s["impressions"])
+                      for s in core.db.db.schedule.find())
+        self.assertEqual(dict((userid, 2) for userid in PARTICIPANTS),
+                         stored)
+
+    def test_flush_size(self):
+        core.config.config["SCHEDULE_FLUSH_SIZE"] = 2
+        heap = core.scheduler.schedule("S1-q1", PARTICIPANTS)
+        self.serve(heap, 2)
+        self.assertEqual(2, core.db.db.schedule.find().count())
+
+
+if __name__ == '__main__':
+    unittest.main()
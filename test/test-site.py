@@ -0,0 +1,80 @@
+# This file is part of Living Labs Challenge, see http://living-labs.net.
+#
+# Living Labs Challenge is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Living Labs Challenge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Living Labs Challenge. If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import unittest
+
+from mongodb import MongoTestCase, core
+
+BLOCK_SIZE = 10
+
+
+class TestIdBlocks(MongoTestCase):
+
+    def setUp(self):
+        super(TestIdBlocks, self).setUp()
+        self.block_size = core.config.config["ID_BLOCK_SIZE"]
+        core.config.config["ID_BLOCK_SIZE"] = BLOCK_SIZE
+        core.site._id_blocks.clear()
+        for site_id in ["S1", "S2"]:
+            core.db.db.site.insert({"_id": site_id, "qid_counter": 0,
+                                    "docid_counter": 0, "sid_counter": 0})
+
+    def tearDown(self):
+        core.config.config["ID_BLOCK_SIZE"] = self.block_size
+        core.site._id_blocks.clear()
+
+    def test_block(self):
+        sids = [core.site.next_sid("S1") for _ in range(BLOCK_SIZE + 1)]
+        self.assertEqual(["S1-s%d" % i for i in range(1, BLOCK_SIZE + 2)],
+                         sids)
+        # One $inc per block
+        self.assertEqual(2 * BLOCK_SIZE,
+                         core.db.db.site.find_one({"_id": "S1"})
+                         ["sid_counter"])
+
+    def test_counters(self):
+        self.assertEqual("S1-q1", core.site.next_qid("S1"))
+        self.assertEqual("S1-d1", core.site.next_docid("S1"))
+        self.assertEqual("S1-s1", core.site.next_sid("S1"))
+        self.assertEqual("S2-s1", core.site.next_sid("S2"))
+        self.assertEqual("S1-s2", core.site.next_sid("S1"))
+
+    def test_processes(self):
+        # Each process reserves its own blocks, so ids do not collide
+        sids = []
+        for process in range(3):
+            core.site._id_blocks.clear()
+            sids += [core.site.next_sid("S1") for _ in range(BLOCK_SIZE / 2)]
+        self.assertEqual(len(sids), len(set(sids)))
+        self.assertIn("S1-s%d" % (2 * BLOCK_SIZE + 1), sids)
+
+    def test_threads(self):
+        sids = []
+
+        def allocate():
+            for _ in range(3 * BLOCK_SIZE):
+                sids.append(core.site.next_sid("S1"))
+
+        threads = [threading.Thread(target=allocate) for _ in range(10)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(30 * BLOCK_SIZE, len(set(sids)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+# This file is part of Living Labs Challenge, see http://living-labs.net.
+#
+# Living Labs Challenge is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Living Labs Challenge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Living Labs Challenge. If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+import json
+import unittest
+
+from mongodb import MongoTestCase, core
+from ll.api import app
+import ll.api.participant
+
+NDJSON = "application/x-ndjson"
+N_DOCS = 5
+
+
+class TestStream(MongoTestCase):
+
+    def setUp(self):
+        super(TestStream, self).setUp()
+        app.debug = True
+        self.client = app.test_client()
+        core.db.db.user.insert({"_id": "P1", "is_participant": True,
+                                "is_verified": True, "is_site": False,
+                                "signed_up_for": ["S1"]})
+        now = datetime.datetime.now()
+        for i in range(N_DOCS):
+            core.db.db.doc.insert({"_id": "S1-d%d" % i, "site_id": "S1",
+                                   "site_docid": "d%d" % i,
+                                   "title": "Document %d" % i,
+                                   "content": {"text": "Lorem ipsum"},
+                                   "creation_time": now})
+            core.db.db.feedback.insert({"_id": "S1-s%d" % i, "site_id": "S1",
+                                        "qid": "S1-q1", "qtype": "train",
+                                        "userid": "P1", "runid": "r1",
+                                        "modified_time": now,
+                                        "doclist": [{"docid": "S1-d%d" % i,
+                                                     "clicked": True}]})
+
+    def get(self, url, mimetype):
+        return self.client.get(url, headers={"Accept": mimetype})
+
+    def lines(self, r):
+        self.assertEqual(200, r.status_code)
+        self.assertEqual(NDJSON, r.mimetype)
+        self.assertTrue(r.data.endswith("\n"))
+        return [json.loads(line) for line in r.data.splitlines()]
+
+    def test_docs(self):
+        docs = self.lines(self.get("/api/participant/docs/P1", NDJSON))
+        self.assertEqual(["S1-d%d" % i for i in range(N_DOCS)],
+                         sorted(d["docid"] for d in docs))
+        self.assertEqual({"text": "Lorem ipsum"}, docs[0]["content"])
+        # The same documents as the JSON response
+        r = self.get("/api/participant/docs/P1", "application/json")
+        self.assertEqual("application/json", r.mimetype)
+        self.assertEqual(sorted(docs), sorted(json.loads(r.data)["docs"]))
+
+    def test_feedback(self):
+        r = self.get("/api/participant/feedback/P1/all", NDJSON)
+        feedback = self.lines(r)
+        self.assertEqual(["S1-s%d" % i for i in range(N_DOCS)],
+                         sorted(f["sid"] for f in feedback))
+        self.assertIn("X-Feedback-Cursor", r.headers)
+        r = self.get("/api/participant/feedback/P1/all", "application/json")
+        self.assertEqual(sorted(feedback),
+                         sorted(json.loads(r.data)["feedback"]))
+
+    def test_empty(self):
+        core.db.db.feedback.remove()
+        r = self.get("/api/participant/feedback/P1/all", NDJSON)
+        self.assertEqual(200, r.status_code)
+        self.assertEqual(NDJSON, r.mimetype)
+        self.assertEqual("", r.data)
+
+    def test_default_json(self):
+        r = self.client.get("/api/participant/docs/P1")
+        self.assertEqual("application/json", r.mimetype)
+        self.assertEqual(N_DOCS, len(json.loads(r.data)["docs"]))
+
+    def test_invalid_since(self):
+        r = self.get("/api/participant/feedback/P1/all?since=yesterday",
+                     NDJSON)
+        self.assertEqual(400, r.status_code)
+
+
+if __name__ == '__main__':
+    unittest.main()
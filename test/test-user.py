@@ -0,0 +1,77 @@
+# This file is part of Living Labs Challenge, see http://living-labs.net.
+#
+# Living Labs Challenge is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Living Labs Challenge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Living Labs Challenge. If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+
+from mongodb import MongoTestCase, core
+
+
+class TestUserCache(MongoTestCase):
+
+    def setUp(self):
+        super(TestUserCache, self).setUp()
+        self.cache_seconds = core.config.config["USER_CACHE_SECONDS"]
+        core.config.config["USER_CACHE_SECONDS"] = 3600
+        core.db.db.user.insert({"_id": "P1", "teamname": "Team",
+                                "is_participant": True, "is_verified": False,
+                                "is_admin": False, "signed_up_for": ["S1"]})
+
+    def tearDown(self):
+        core.config.config["USER_CACHE_SECONDS"] = self.cache_seconds
+        core.user.invalidate()
+
+    def test_cached(self):
+        self.assertEqual(["S1"], core.user.get_sites("P1"))
+        # A change made by another process is only seen once the entry
+        # expired
+        core.db.db.user.update_one({"_id": "P1"},
+                                   {"$set": {"signed_up_for": ["S2"]}})
+        self.assertEqual(["S1"], core.user.get_sites("P1"))
+        core.user._users["P1"] = (0, core.user._users["P1"][1])
+        self.assertEqual(["S2"], core.user.get_sites("P1"))
+
+    def test_copy(self):
+        user = core.user.get_user("P1")
+        user["is_admin"] = True
+        self.assertFalse(core.user.get_user("P1")["is_admin"])
+
+    def test_set_sites(self):
+        core.user.get_user("P1")
+        core.user.set_sites("P1", ["S1", "S2"])
+        self.assertEqual(["S1", "S2"], core.user.get_sites("P1"))
+
+    def test_updates(self):
+        core.user.get_user("P1")
+        core.user.unverify_user("P1")
+        core.user.set_admin("P1")
+        self.assertTrue(core.user.get_user("P1")["is_admin"])
+        user = core.user.get_user("P1")
+        user["teamname"] = "Other"
+        core.user.save_user(user)
+        self.assertEqual("Other", core.user.get_user("P1")["teamname"])
+
+    def test_delete(self):
+        core.user.get_user("P1")
+        core.user.delete_user("P1")
+        self.assertRaises(Exception, core.user.get_user, "P1")
+
+    def test_unknown_user(self):
+        self.assertRaises(Exception, core.user.get_user, "P9")
+        core.db.db.user.insert({"_id": "P9"})
+        self.assertEqual("P9", core.user.get_user("P9")["_id"])
+
+
+if __name__ == '__main__':
+    unittest.main()